@@ -0,0 +1,367 @@
+import os
+import json
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class AudioCache:
+    """
+    Index of the songs downloaded to the audio cache folder, so finding a cached song
+    doesn't mean listing the whole folder.
+
+    Songs are keyed by the name ytdl gives them ("extractor-id-title") without the extension,
+    which is what identifies a song regardless of the format it ended up downloaded in.
+    The index is saved next to the rest of the bot's data, and is reconciled with the
+    folder whenever the folder was changed behind its back.
+
+    The cache can be bounded by size (`max_size` bytes) and age (`max_age` seconds since a song
+    was last used), see `evict`. `policy` picks what goes first when it's too big: the least
+    recently used ("lru") or least often used ("lfu") songs.
+    """
+
+    def __init__(
+        self, folder, index_file, *, max_size=0, max_age=0, policy="lru", save_delay=10
+    ):
+        self.folder = folder
+        self.index_file = index_file
+        self.max_size = max_size
+        self.max_age = max_age
+        self.policy = policy
+        self.save_delay = save_delay
+
+        self._files = None
+        self._doomed = set()
+        self._folder_mtime = None
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+
+    @staticmethod
+    def expected_key(expected_filename):
+        return os.path.splitext(os.path.basename(expected_filename))[0]
+
+    @staticmethod
+    def file_key(filename):
+        key = os.path.splitext(os.path.basename(filename))[0]
+
+        # Generic downloads have part of their hash added to the name, see _really_download
+        if key.startswith("generic-"):
+            key = key.rsplit("-", 1)[0]
+
+        return key
+
+    def _load(self):
+        if self._files is not None:
+            return
+
+        try:
+            folder_mtime = os.stat(self.folder).st_mtime
+        except OSError:
+            self._files = {}
+            return
+
+        try:
+            with open(self.index_file, encoding="utf8") as f:
+                data = json.load(f)
+
+            if data.get("folder") != os.path.abspath(self.folder):
+                raise ValueError("index is for a different folder")
+
+            self._files = data["files"]
+            self._folder_mtime = data["mtime"]
+
+        except FileNotFoundError:
+            self._files = {}
+
+        except Exception:
+            log.warning(
+                "Could not read audio cache index {}, rebuilding it".format(
+                    self.index_file
+                ),
+                exc_info=True,
+            )
+            self._files = {}
+
+        if self._folder_mtime != folder_mtime:
+            self._reconcile()
+
+    def _reconcile(self):
+        """
+        Brings the index up to date with the contents of the folder.
+        """
+        log.debug("Scanning {} for the audio cache index".format(self.folder))
+        t0 = time.time()
+
+        seen = set()
+        added = 0
+
+        with os.scandir(self.folder) as it:
+            for dirent in it:
+                if not dirent.is_file() or dirent.name.startswith("."):
+                    continue
+
+                # Leftovers of downloads that didn't finish
+                if dirent.name.endswith((".part", ".ytdl", ".temp")):
+                    continue
+
+                key = self.file_key(dirent.name)
+                seen.add(key)
+
+                record = self._files.get(key)
+                if record and record["filename"] == dirent.name:
+                    continue
+
+                self._files[key] = self._make_record(dirent.name, dirent.stat())
+                added += 1
+
+        removed = [key for key in self._files if key not in seen]
+        for key in removed:
+            del self._files[key]
+
+        self._folder_mtime = os.stat(self.folder).st_mtime
+        log.debug(
+            "Audio cache index: {} songs, {} added and {} removed in {:.2f}s".format(
+                len(self._files), added, len(removed), time.time() - t0
+            )
+        )
+
+        if added or removed:
+            self._schedule_save()
+
+    @staticmethod
+    def _make_record(filename, stat, used=None):
+        return {
+            "filename": filename,
+            "size": stat.st_size,
+            "duration": None,
+            "used": used or stat.st_mtime,
+            "hits": 0,
+        }
+
+    def lookup(self, expected_filename):
+        """
+        Returns the path and record of the cached song for `expected_filename`, or (None, None).
+        """
+        with self._lock:
+            self._load()
+            key = self.expected_key(expected_filename)
+            record = self._files.get(key)
+            if not record:
+                return None, None
+
+            path = os.path.join(self.folder, record["filename"])
+            if not os.path.isfile(path):
+                log.debug("Cached file {} is gone, dropping it".format(path))
+                self._discard(key)
+                return None, None
+
+            record["used"] = time.time()
+            record["hits"] = record.get("hits", 0) + 1
+            self._schedule_save()
+
+            return path, dict(record)
+
+    def contains(self, expected_filename):
+        """
+        Returns whether the song for `expected_filename` is cached, without counting it as used.
+        """
+        with self._lock:
+            self._load()
+            record = self._files.get(self.expected_key(expected_filename))
+            return bool(record) and os.path.isfile(
+                os.path.join(self.folder, record["filename"])
+            )
+
+    def add(self, filename, **data):
+        """
+        Records `filename` (inside the cache folder) as downloaded, returning its record.
+        """
+        with self._lock:
+            self._load()
+            record = self._make_record(
+                os.path.basename(filename), os.stat(filename), time.time()
+            )
+            record.update(data)
+
+            self._files[self.file_key(filename)] = record
+            self._touch_folder()
+            self._schedule_save()
+            return dict(record)
+
+    def update(self, filename, **data):
+        """
+        Merges `data` into the record of `filename`, if there is one.
+        """
+        with self._lock:
+            self._load()
+            record = self._files.get(self.file_key(filename))
+            if record and record["filename"] == os.path.basename(filename):
+                record.update(data)
+                self._schedule_save()
+
+    def discard(self, filename):
+        with self._lock:
+            self._load()
+            key = self.file_key(filename)
+            record = self._files.get(key)
+            if record and record["filename"] == os.path.basename(filename):
+                self._discard(key)
+
+    def _discard(self, key):
+        del self._files[key]
+        self._touch_folder()
+        self._schedule_save()
+
+    def remove(self, filename):
+        """
+        Deletes `filename` from the cache. Files that are still in use are deleted by a later `evict`.
+        """
+        with self._lock:
+            self._load()
+            self.discard(filename)
+
+            if not self._unlink(filename):
+                self._doomed.add(filename)
+
+    @staticmethod
+    def _unlink(filename):
+        try:
+            os.unlink(filename)
+            log.debug("File deleted: {0}".format(filename))
+
+        except FileNotFoundError:
+            log.debug("Could not delete {}, it was not found".format(filename))
+
+        except PermissionError:
+            # Most likely still open in ffmpeg on windows
+            log.debug("Can't delete {} yet, it is in use".format(filename))
+            return False
+
+        except Exception:
+            log.error("Error trying to delete {}".format(filename), exc_info=True)
+
+        return True
+
+    @property
+    def total_size(self):
+        with self._lock:
+            self._load()
+            return sum(record["size"] for record in self._files.values())
+
+    def evict(self, pinned_keys=(), pinned_urls=()):
+        """
+        Deletes the songs that are over the age limit, then the least valuable songs until the cache
+        fits the size limit. Songs in `pinned_keys` (see `expected_key`) or downloaded from one of
+        `pinned_urls` are never evicted. Files that couldn't be deleted earlier are retried first.
+
+        Returns how many songs were evicted and how many bytes that freed.
+        """
+        with self._lock:
+            self._load()
+
+            for filename in list(self._doomed):
+                if self._unlink(filename):
+                    self._doomed.discard(filename)
+
+            candidates = [
+                (key, record)
+                for key, record in self._files.items()
+                if key not in pinned_keys and record.get("url") not in pinned_urls
+            ]
+
+            evicted = {}
+            if self.max_age:
+                oldest = time.time() - self.max_age
+                evicted.update(c for c in candidates if c[1]["used"] < oldest)
+
+            if self.max_size:
+                excess = self.total_size - self.max_size
+                excess -= sum(record["size"] for record in evicted.values())
+
+                if self.policy == "lfu":
+                    rank = lambda c: (c[1].get("hits", 0), c[1]["used"])
+                else:
+                    rank = lambda c: c[1]["used"]
+
+                for key, record in sorted(candidates, key=rank):
+                    if excess <= 0:
+                        break
+
+                    if key not in evicted:
+                        evicted[key] = record
+                        excess -= record["size"]
+
+            count = freed = 0
+            for key, record in evicted.items():
+                if self._unlink(os.path.join(self.folder, record["filename"])):
+                    del self._files[key]
+                    count += 1
+                    freed += record["size"]
+
+            if count:
+                self._touch_folder()
+                self._schedule_save()
+                log.info(
+                    "Evicted {} songs ({:.1f} MB) from the audio cache".format(
+                        count, freed / 1024 / 1024
+                    )
+                )
+
+            return count, freed
+
+    def _touch_folder(self):
+        # Our own changes to the folder shouldn't make the next startup rescan it
+        try:
+            self._folder_mtime = os.stat(self.folder).st_mtime
+        except OSError:
+            pass
+
+    def _schedule_save(self):
+        if self._save_timer is not None:
+            return
+
+        self._save_timer = threading.Timer(self.save_delay, self.save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def save(self):
+        """
+        Writes the index to disk. Changes are batched up and saved a few seconds after they're made,
+        call this directly to save them right away.
+        """
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+
+                if self._files is None:
+                    return
+
+                data = json.dumps(
+                    {
+                        "version": 1,
+                        "folder": os.path.abspath(self.folder),
+                        "mtime": self._folder_mtime,
+                        "files": self._files,
+                    }
+                )
+
+            tmp_file = self.index_file + ".tmp"
+            try:
+                with open(tmp_file, "w", encoding="utf8") as f:
+                    f.write(data)
+                os.replace(tmp_file, self.index_file)
+            except OSError:
+                log.warning(
+                    "Could not save audio cache index {}".format(self.index_file),
+                    exc_info=True,
+                )
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._files)
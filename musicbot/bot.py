@@ -30,6 +30,10 @@ from . import downloader
 from .playlist import Playlist
 from .player import MusicPlayer
 from .entry import StreamPlaylistEntry
+from .audiocache import AudioCache
+from .loudness import LoudnessAnalyzer
+from .supervisor import FFmpegSupervisor
+from .persistence import QueuePersistence, QueueJournal
 from .opus_loader import load_opus_lib
 from .config import Config, ConfigDefaults
 from .permissions import Permissions, PermissionsDefaults
@@ -40,6 +44,7 @@ from .utils import (
     write_file,
     fixg,
     ftimedelta,
+    parse_duration,
     _func_,
     _get_variable,
     format_song_duration,
@@ -100,7 +105,11 @@ class MusicBot(discord.Client):
         self.autoplaylist = load_file(self.config.auto_playlist_file)
 
         self.aiolocks = defaultdict(asyncio.Lock)
-        self.downloader = downloader.Downloader(download_folder="audio_cache")
+        self.downloader = downloader.Downloader(
+            download_folder="audio_cache", config=self.config
+        )
+        self.loudness_analyzer = LoudnessAnalyzer(self.downloader.audio_cache)
+        self.ffmpeg_supervisor = FFmpegSupervisor()
 
         log.info("Starting MusicBot {}".format(BOTVERSION))
 
@@ -128,6 +137,7 @@ class MusicBot(discord.Client):
         self.aiosession = aiohttp.ClientSession(
             loop=self.loop, headers={"User-Agent": self.http.user_agent}
         )
+        self.queue_persistence = QueuePersistence(self.loop)
 
         self.spotify = None
         if self.config._spotify:
@@ -495,6 +505,9 @@ class MusicBot(discord.Client):
             return
 
         if guild.id in self.players:
+            # Queues are saved lazily, so save them while the player still has them
+            await self.serialize_queue(guild)
+            self.queue_persistence.flush()
             self.players.pop(guild.id).kill()
 
         await vc.disconnect()
@@ -549,6 +562,7 @@ class MusicBot(discord.Client):
             .on("stop", self.on_player_stop)
             .on("finished-playing", self.on_player_finished_playing)
             .on("entry-added", self.on_player_entry_added)
+            .on("entries-added", self.on_player_entries_added)
             .on("error", self.on_player_error)
         )
 
@@ -557,6 +571,18 @@ class MusicBot(discord.Client):
         if guild:
             self.players[guild.id] = player
 
+            if self.config.queue_journal:
+                player.playlist.journal = QueueJournal(
+                    self.queue_persistence,
+                    guild.id,
+                    "data/%s/queue.journal" % guild.id,
+                    lambda: {
+                        "entries": list(player.playlist.entries),
+                        "current": player.current_entry,
+                        "progress": player.progress,
+                    },
+                )
+
         return player
 
     async def on_player_play(self, player, entry):
@@ -660,7 +686,7 @@ class MusicBot(discord.Client):
         log.debug("Running on_player_stop")
         await self.update_now_playing_status()
 
-    async def on_player_finished_playing(self, player, **_):
+    async def on_player_finished_playing(self, player, gapless=False, **_):
         log.debug("Running on_player_finished_playing")
 
         # delete last_np_msg somewhere if we have cached it
@@ -707,7 +733,11 @@ class MusicBot(discord.Client):
 
                 try:
                     info = await self.downloader.extract_info(
-                        player.playlist.loop, song_url, download=False, process=False
+                        player.playlist.loop,
+                        song_url,
+                        download=False,
+                        process=False,
+                        group=player.playlist,
                     )
                 except downloader.youtube_dl.utils.DownloadError as e:
                     if "YouTube said:" in e.args[0]:
@@ -765,7 +795,8 @@ class MusicBot(discord.Client):
         else:  # Don't serialize for autoplaylist events
             await self.serialize_queue(player.voice_client.channel.guild)
 
-        if not player.is_stopped and not player.is_dead:
+        # After a gapless transition the next song is already playing
+        if not player.is_stopped and not player.is_dead and not gapless:
             player.play(_continue=True)
 
     async def on_player_entry_added(self, player, playlist, entry, **_):
@@ -773,6 +804,13 @@ class MusicBot(discord.Client):
         if entry.meta.get("author") and entry.meta.get("channel"):
             await self.serialize_queue(player.voice_client.channel.guild)
 
+    async def on_player_entries_added(self, player, playlist, entries, **_):
+        log.debug("Running on_player_entries_added")
+        if any(
+            entry.meta.get("author") and entry.meta.get("channel") for entry in entries
+        ):
+            await self.serialize_queue(player.voice_client.channel.guild)
+
     async def on_player_error(self, player, entry, ex, **_):
         if "channel" in entry.meta:
             await self.safe_send_message(
@@ -845,7 +883,8 @@ class MusicBot(discord.Client):
 
     async def serialize_queue(self, guild, *, dir=None):
         """
-        Serialize the current queue for a server's player to json.
+        Serialize the current queue for a server's player to json. The queue is written a few
+        seconds later in the background, along with any other changes made by then.
         """
 
         player = self.get_player_in(guild)
@@ -853,13 +892,19 @@ class MusicBot(discord.Client):
             return
 
         if dir is None:
-            dir = "data/%s/queue.json" % guild.id
+            # Changes to the queue itself are already in the journal
+            if player.playlist.journal:
+                player.playlist.journal.record(
+                    "current", entry=player.current_entry, progress=player.progress
+                )
+                return
 
-        async with self.aiolocks["queue_serialization" + ":" + str(guild.id)]:
-            log.debug("Serializing queue for %s", guild.id)
+            dir = "data/%s/queue.json" % guild.id
 
-            with open(dir, "w", encoding="utf8") as f:
-                f.write(player.serialize(sort_keys=True))
+        log.debug("Queue for %s changed", guild.id)
+        self.queue_persistence.mark_dirty(
+            (guild.id, dir), dir, lambda: player.serialize(sort_keys=True)
+        )
 
     async def serialize_all_queues(self, *, dir=None):
         coros = [self.serialize_queue(s, dir=dir) for s in self.guilds]
@@ -875,6 +920,15 @@ class MusicBot(discord.Client):
         if playlist is None:
             playlist = Playlist(self)
 
+        journal = "data/%s/queue.journal" % guild.id
+        if dir is None and self.config.queue_journal and os.path.isfile(journal):
+            log.debug("Replaying queue journal for %s", guild.id)
+
+            with open(journal, "r", encoding="utf8") as f:
+                data = f.read()
+
+            return MusicPlayer.from_journal(data, self, voice_client, playlist)
+
         if dir is None:
             dir = "data/%s/queue.json" % guild.id
 
@@ -1047,6 +1101,57 @@ class MusicBot(discord.Client):
     def restart_threadsafe(self):
         asyncio.run_coroutine_threadsafe(self.restart(), self.loop)
 
+    def _audio_cache_pins(self):
+        """
+        Returns the cache keys of every queued or playing song, and the autoplaylist urls.
+        """
+        keys = set()
+
+        for player in self.players.values():
+            entries = list(player.playlist.entries)
+            if player.current_entry:
+                entries.append(player.current_entry)
+
+            for entry in entries:
+                if isinstance(entry, StreamPlaylistEntry):
+                    continue
+
+                if entry.filename:
+                    keys.add(AudioCache.file_key(entry.filename))
+                if entry.expected_filename:
+                    keys.add(AudioCache.expected_key(entry.expected_filename))
+
+        return keys, set(self.autoplaylist)
+
+    async def _audio_cache_janitor(self, interval=300):
+        """
+        Keeps the audio cache within its limits, and deletes files that were still in use when
+        they were supposed to be deleted.
+        """
+        while not self.is_closed():
+            pinned_keys, pinned_urls = self._audio_cache_pins()
+
+            try:
+                await self.loop.run_in_executor(
+                    None, self.downloader.audio_cache.evict, pinned_keys, pinned_urls
+                )
+            except Exception:
+                log.error("Error cleaning up the audio cache", exc_info=True)
+
+            await asyncio.sleep(interval)
+
+    async def _save_progress_periodically(self, interval=15):
+        """
+        Saves how far into their songs the players are every so often, so a crash doesn't
+        restart the song that was playing from the beginning.
+        """
+        while not self.is_closed():
+            await asyncio.sleep(interval)
+
+            for player in list(self.players.values()):
+                if player.is_playing:
+                    await self.serialize_queue(player.voice_client.channel.guild)
+
     def _cleanup(self):
         try:
             self.loop.run_until_complete(self.logout())
@@ -1064,6 +1169,9 @@ class MusicBot(discord.Client):
         except:
             pass
 
+        self.queue_persistence.close()
+        self.downloader.shutdown()
+
     # noinspection PyMethodOverriding
     def run(self):
         try:
@@ -1128,6 +1236,12 @@ class MusicBot(discord.Client):
 
         self.init_ok = True
 
+        if self.downloader.audio_cache:
+            self.loop.create_task(self._audio_cache_janitor())
+
+        if self.config.persistent_queue:
+            self.loop.create_task(self._save_progress_periodically())
+
         ################################
 
         log.info(
@@ -1856,13 +1970,20 @@ class MusicBot(discord.Client):
 
         async def get_info(song_url):
             info = await self.downloader.extract_info(
-                player.playlist.loop, song_url, download=False, process=False
+                player.playlist.loop,
+                song_url,
+                download=False,
+                process=False,
+                group=player.playlist,
             )
             # If there is an exception arise when processing we go on and let extract_info down the line report it
             # because info might be a playlist and thing that's broke it might be individual entry
             try:
                 info_process = await self.downloader.extract_info(
-                    player.playlist.loop, song_url, download=False
+                    player.playlist.loop,
+                    song_url,
+                    download=False,
+                    group=player.playlist,
                 )
                 info_process_err = None
             except Exception as e:
@@ -1991,7 +2112,7 @@ class MusicBot(discord.Client):
 
                 num_songs = sum(1 for _ in info["entries"])
 
-                if info["extractor"].lower() in [
+                if not self.config.lazy_playlists and info["extractor"].lower() in [
                     "youtube:playlist",
                     "soundcloud:set",
                     "bandcamp:album",
@@ -2036,7 +2157,7 @@ class MusicBot(discord.Client):
                         self.str.get(
                             "cmd-play-playlist-gathering-2", ", ETA: {0} seconds"
                         ).format(fixg(num_songs * wait_per_song))
-                        if num_songs >= 10
+                        if num_songs >= 10 and not self.config.lazy_playlists
                         else ".",
                     ),
                 )
@@ -2059,8 +2180,9 @@ class MusicBot(discord.Client):
 
                 if permissions.max_song_length:
                     for e in entry_list.copy():
-                        if e.duration > permissions.max_song_length:
-                            player.playlist.entries.remove(e)
+                        # Lazy entries that don't know their duration yet are checked once they're resolved
+                        if e.duration and e.duration > permissions.max_song_length:
+                            player.playlist.remove(e)
                             entry_list.remove(e)
                             drop_count += 1
                             # Im pretty sure there's no situation where this would ever break
@@ -2108,6 +2230,7 @@ class MusicBot(discord.Client):
                             "https://www.youtube.com/watch?v=%s" % info.get("url", ""),
                             download=False,
                             process=False,
+                            group=player.playlist,
                         )
                     except Exception as e:
                         raise exceptions.CommandError(e, expire_in=30)
@@ -2165,7 +2288,11 @@ class MusicBot(discord.Client):
 
         await self.send_typing(channel)
         info = await self.downloader.extract_info(
-            player.playlist.loop, playlist_url, download=False, process=False
+            player.playlist.loop,
+            playlist_url,
+            download=False,
+            process=False,
+            group=player.playlist,
         )
 
         if not info:
@@ -2186,13 +2313,31 @@ class MusicBot(discord.Client):
         )  # TODO: From playlist_title
         await self.send_typing(channel)
 
+        last_progress = time.time()
+
+        async def report_progress(processed, total):
+            nonlocal last_progress
+            if not busymsg or processed == total or time.time() - last_progress < 5:
+                return
+
+            last_progress = time.time()
+            await self.safe_edit_message(
+                busymsg,
+                self.str.get(
+                    "cmd-play-playlist-progress", "Processing songs... {0}/{1}"
+                ).format(processed, total),
+                quiet=True,
+            )
+
         entries_added = 0
         if extractor_type == "youtube:playlist":
             try:
                 entries_added = await player.playlist.async_process_youtube_playlist(
-                    playlist_url, channel=channel, author=author
+                    playlist_url,
+                    on_progress=report_progress,
+                    channel=channel,
+                    author=author,
                 )
-                # TODO: Add hook to be called after each song
                 # TODO: Add permissions
 
             except Exception:
@@ -2208,9 +2353,11 @@ class MusicBot(discord.Client):
         elif extractor_type.lower() in ["soundcloud:set", "bandcamp:album"]:
             try:
                 entries_added = await player.playlist.async_process_sc_bc_playlist(
-                    playlist_url, channel=channel, author=author
+                    playlist_url,
+                    on_progress=report_progress,
+                    channel=channel,
+                    author=author,
                 )
-                # TODO: Add hook to be called after each song
                 # TODO: Add permissions
 
             except Exception:
@@ -2229,9 +2376,9 @@ class MusicBot(discord.Client):
 
         if permissions.max_song_length:
             for e in entries_added.copy():
-                if e.duration > permissions.max_song_length:
+                if e.duration and e.duration > permissions.max_song_length:
                     try:
-                        player.playlist.entries.remove(e)
+                        player.playlist.remove(e)
                         entries_added.remove(e)
                         drop_count += 1
                     except:
@@ -2242,6 +2389,7 @@ class MusicBot(discord.Client):
 
             if (
                 player.current_entry
+                and player.current_entry.duration
                 and player.current_entry.duration > permissions.max_song_length
             ):
                 await self.safe_delete_message(
@@ -2484,7 +2632,11 @@ class MusicBot(discord.Client):
 
         try:
             info = await self.downloader.extract_info(
-                player.playlist.loop, search_query, download=False, process=True
+                player.playlist.loop,
+                search_query,
+                download=False,
+                process=True,
+                group=player.playlist,
             )
 
         except Exception as e:
@@ -2865,6 +3017,50 @@ class MusicBot(discord.Client):
                 self.str.get("cmd-resume-none", "Player is not paused."), expire_in=30
             )
 
+    async def cmd_seek(self, player, position):
+        """
+        Usage:
+            {command_prefix}seek (+/-)[seconds or minutes:seconds]
+
+        Jumps to a point in the current song.
+        Putting + or - before the time will jump forwards or backwards from where the song is at.
+        """
+
+        if not player.current_entry:
+            raise exceptions.CommandError(
+                self.str.get("cmd-seek-none", "There is nothing playing to seek in."),
+                expire_in=20,
+            )
+
+        try:
+            offset = parse_duration(position.lstrip("+-"))
+        except ValueError:
+            raise exceptions.CommandError(
+                self.str.get("cmd-seek-invalid", "`{0}` is not a valid time").format(
+                    position
+                ),
+                expire_in=20,
+            )
+
+        if position[0] == "+":
+            offset = player.progress + offset
+        elif position[0] == "-":
+            offset = player.progress - offset
+
+        if not player.seek(offset):
+            raise exceptions.CommandError(
+                self.str.get("cmd-seek-stream", "Streams can't be seeked."),
+                expire_in=20,
+            )
+
+        return Response(
+            self.str.get("cmd-seek-reply", "Jumped to `{0}` in **{1}**").format(
+                ftimedelta(timedelta(seconds=player.progress)),
+                player.current_entry.title,
+            ),
+            delete_after=20,
+        )
+
     async def cmd_shuffle(self, channel, player):
         """
         Usage:
@@ -2941,7 +3137,7 @@ class MusicBot(discord.Client):
                             if e.meta.get("author", None) == user
                         ]
                         for entry in entry_indexes:
-                            player.playlist.entries.remove(entry)
+                            player.playlist.remove(entry)
                         entry_text = "%s " % len(entry_indexes) + "item"
                         if len(entry_indexes) > 1:
                             entry_text += "s"
@@ -3816,6 +4012,16 @@ class MusicBot(discord.Client):
 
         return Response(data, codeblock="py")
 
+    @dev_only
+    async def cmd_workers(self, message):
+        lines = [
+            "{}: {running}/{workers} running, {queued} queued, {groups} servers "
+            "({backend})".format(name, **stats)
+            for name, stats in self.downloader.stats().items()
+        ]
+
+        return Response("\n".join(lines), codeblock=True)
+
     @dev_only
     async def cmd_debug(self, message, _player, *, data):
         codeblock = "```py\n{}\n```"
@@ -4308,6 +4514,7 @@ class MusicBot(discord.Client):
         [log.debug(" - " + s.name) for s in self.guilds]
 
         if guild.id in self.players:
+            self.queue_persistence.flush()
             self.players.pop(guild.id).kill()
 
     async def on_guild_available(self, guild: discord.Guild):
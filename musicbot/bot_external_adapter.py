@@ -60,7 +60,9 @@ class MusicBotAdapter(MusicBot):
         self.autoplaylist = load_file(self.config.auto_playlist_file)
 
         self.aiolocks = defaultdict(asyncio.Lock)
-        self.downloader = downloader.Downloader(download_folder="audio_cache")
+        self.downloader = downloader.Downloader(
+            download_folder="audio_cache", config=self.config
+        )
 
         log.info("Starting MusicBot {}".format(BOTVERSION))
 
@@ -178,6 +178,78 @@ class Config:
             "DefaultSearchResults",
             fallback=ConfigDefaults.defaultsearchresults,
         )
+        self.metadata_cache_ttl = config.getint(
+            "MusicBot", "MetadataCacheTTL", fallback=ConfigDefaults.metadata_cache_ttl
+        )
+        self.metadata_cache_size = config.getint(
+            "MusicBot",
+            "MetadataCacheSize",
+            fallback=ConfigDefaults.metadata_cache_size,
+        )
+        self.metadata_workers = config.getint(
+            "MusicBot", "MetadataWorkers", fallback=ConfigDefaults.metadata_workers
+        )
+        self.download_workers = config.getint(
+            "MusicBot", "DownloadWorkers", fallback=ConfigDefaults.download_workers
+        )
+        self.search_workers = config.getint(
+            "MusicBot", "SearchWorkers", fallback=ConfigDefaults.search_workers
+        )
+        self.extraction_backend = config.get(
+            "MusicBot",
+            "ExtractionBackend",
+            fallback=ConfigDefaults.extraction_backend,
+        )
+        self.extraction_worker_recycle = config.getint(
+            "MusicBot",
+            "ExtractionWorkerRecycle",
+            fallback=ConfigDefaults.extraction_worker_recycle,
+        )
+        self.playlist_concurrency = config.getint(
+            "MusicBot",
+            "PlaylistConcurrency",
+            fallback=ConfigDefaults.playlist_concurrency,
+        )
+        self.lazy_playlists = config.getboolean(
+            "MusicBot", "LazyPlaylists", fallback=ConfigDefaults.lazy_playlists
+        )
+        self.audio_cache_max_size = config.getint(
+            "MusicBot", "AudioCacheMaxSize", fallback=ConfigDefaults.audio_cache_max_size
+        )
+        self.audio_cache_max_age = config.getint(
+            "MusicBot", "AudioCacheMaxAge", fallback=ConfigDefaults.audio_cache_max_age
+        )
+        self.audio_cache_policy = config.get(
+            "MusicBot", "AudioCachePolicy", fallback=ConfigDefaults.audio_cache_policy
+        )
+        self.progressive_playback = config.getboolean(
+            "MusicBot",
+            "ProgressivePlayback",
+            fallback=ConfigDefaults.progressive_playback,
+        )
+        self.predownload_count = config.getint(
+            "MusicBot", "PredownloadCount", fallback=ConfigDefaults.predownload_count
+        )
+        self.predownload_minutes = config.getint(
+            "MusicBot",
+            "PredownloadMinutes",
+            fallback=ConfigDefaults.predownload_minutes,
+        )
+        self.max_predownloads = config.getint(
+            "MusicBot", "MaxPredownloads", fallback=ConfigDefaults.max_predownloads
+        )
+        self.opus_passthrough = config.getboolean(
+            "MusicBot", "OpusPassthrough", fallback=ConfigDefaults.opus_passthrough
+        )
+        self.ffmpeg_volume = config.getboolean(
+            "MusicBot", "FFmpegVolume", fallback=ConfigDefaults.ffmpeg_volume
+        )
+        self.gapless_playback = config.getboolean(
+            "MusicBot", "GaplessPlayback", fallback=ConfigDefaults.gapless_playback
+        )
+        self.queue_journal = config.getboolean(
+            "MusicBot", "QueueJournal", fallback=ConfigDefaults.queue_journal
+        )
 
         self.debug_level = config.get(
             "MusicBot", "DebugLevel", fallback=ConfigDefaults.debug_level
@@ -370,6 +442,64 @@ class Config:
         if not self.footer_text:
             self.footer_text = ConfigDefaults.footer_text
 
+        if self.metadata_cache_ttl < 0:
+            log.warning("MetadataCacheTTL cannot be negative, disabling the cache")
+            self.metadata_cache_ttl = 0
+
+        if self.metadata_cache_size < 1:
+            log.warning(
+                "MetadataCacheSize must be at least 1, using {}".format(
+                    ConfigDefaults.metadata_cache_size
+                )
+            )
+            self.metadata_cache_size = ConfigDefaults.metadata_cache_size
+
+        for option, attr in (
+            ("MetadataWorkers", "metadata_workers"),
+            ("DownloadWorkers", "download_workers"),
+            ("SearchWorkers", "search_workers"),
+            ("PlaylistConcurrency", "playlist_concurrency"),
+            ("PredownloadCount", "predownload_count"),
+            ("MaxPredownloads", "max_predownloads"),
+        ):
+            if getattr(self, attr) < 1:
+                log.warning(
+                    "{} must be at least 1, using {}".format(
+                        option, getattr(ConfigDefaults, attr)
+                    )
+                )
+                setattr(self, attr, getattr(ConfigDefaults, attr))
+
+        self.extraction_backend = self.extraction_backend.strip().lower()
+        if self.extraction_backend not in ("thread", "process"):
+            log.warning(
+                'Invalid ExtractionBackend option "{}" given, falling back to {}'.format(
+                    self.extraction_backend, ConfigDefaults.extraction_backend
+                )
+            )
+            self.extraction_backend = ConfigDefaults.extraction_backend
+
+        if self.extraction_worker_recycle < 0:
+            self.extraction_worker_recycle = 0
+
+        if self.predownload_minutes < 0:
+            self.predownload_minutes = 0
+
+        if self.audio_cache_max_size < 0:
+            self.audio_cache_max_size = 0
+
+        if self.audio_cache_max_age < 0:
+            self.audio_cache_max_age = 0
+
+        self.audio_cache_policy = self.audio_cache_policy.strip().lower()
+        if self.audio_cache_policy not in ("lru", "lfu"):
+            log.warning(
+                'Invalid AudioCachePolicy option "{}" given, falling back to {}'.format(
+                    self.audio_cache_policy, ConfigDefaults.audio_cache_policy
+                )
+            )
+            self.audio_cache_policy = ConfigDefaults.audio_cache_policy
+
     def create_empty_file_ifnoexist(self, path):
         if not os.path.isfile(path):
             open(path, "a").close()
@@ -517,6 +647,26 @@ class ConfigDefaults:
     usealias = True
     searchlist = False
     defaultsearchresults = 3
+    metadata_cache_ttl = 3600
+    metadata_cache_size = 500
+    metadata_workers = 8
+    download_workers = 2
+    search_workers = 2
+    extraction_backend = "thread"
+    extraction_worker_recycle = 100
+    playlist_concurrency = 6
+    lazy_playlists = False
+    audio_cache_max_size = 0
+    audio_cache_max_age = 0
+    audio_cache_policy = "lru"
+    progressive_playback = False
+    predownload_count = 2
+    predownload_minutes = 0
+    max_predownloads = 3
+    opus_passthrough = False
+    ffmpeg_volume = False
+    gapless_playback = False
+    queue_journal = False
     footer_text = "Just-Some-Bots/MusicBot ({})".format(BOTVERSION)
 
     options_file = "config/options.ini"
@@ -525,6 +675,8 @@ class ConfigDefaults:
         "config/autoplaylist.txt"  # this will change when I add playlists
     )
     i18n_file = "config/i18n/en.json"
+    metadata_cache_file = "data/metadata_cache.sqlite"
+    audio_cache_index_file = "data/audio_cache_index.json"
 
 
 setattr(
@@ -1,12 +1,10 @@
 import json
-import pydoc
-import inspect
 import logging
 
 import discord
 
 from enum import Enum
-from .utils import objdiff, _get_variable
+from .utils import objdiff
 
 log = logging.getLogger(__name__)
 
@@ -73,39 +71,40 @@ class Serializer(json.JSONEncoder):
         return super().default(o)
 
     @classmethod
-    def deserialize(cls, data):
+    def deserialize(cls, data, context):
         if all(x in data for x in Serializable._class_signature):
-            # log.debug("Deserialization requested for %s", data)
-            factory = pydoc.locate(data["__module__"] + "." + data["__class__"])
-            # log.debug("Found object %s", factory)
-            if factory and issubclass(factory, Serializable):
-                # log.debug("Deserializing %s object", factory)
-                return factory._deserialize(
-                    data["data"], **cls._get_vars(factory._deserialize)
-                )
+            factory = Serializable._classes.get((data["__module__"], data["__class__"]))
+            if factory:
+                return factory._deserialize(data["data"], context)
 
         return data
 
-    @classmethod
-    def _get_vars(cls, func):
-        # log.debug("Getting vars for %s", func)
-        params = inspect.signature(func).parameters.copy()
-        args = {}
-        # log.debug("Got %s", params)
 
-        for name, param in params.items():
-            # log.debug("Checking arg %s, type %s", name, param.kind)
-            if param.kind is param.POSITIONAL_OR_KEYWORD and param.default is None:
-                # log.debug("Using var %s", name)
-                args[name] = _get_variable(name)
-                # log.debug("Collected var for arg '%s': %s", name, args[name])
+class DeserializationContext:
+    """
+    What's needed to deserialize a player, its playlist and their entries: the bot, and the
+    voice client and playlist they belong to. Use `object_hook` as the object_hook of json.loads.
+    """
+
+    def __init__(self, bot=None, voice_client=None, playlist=None):
+        self.bot = bot
+        self.voice_client = voice_client
+        self.playlist = playlist
 
-        return args
+    def object_hook(self, data):
+        return Serializer.deserialize(data, self)
 
 
 class Serializable:
     _class_signature = ("__class__", "__module__", "data")
 
+    # Every serializable class by module and name, to find them again when deserializing
+    _classes = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Serializable._classes[cls.__module__, cls.__qualname__] = cls
+
     def _enclose_json(self, data):
         return {
             "__class__": self.__class__.__qualname__,
@@ -125,5 +124,5 @@ class Serializable:
         raise NotImplementedError
 
     @classmethod
-    def _deserialize(cls, raw_json, **kwargs):
+    def _deserialize(cls, raw_json, context):
         raise NotImplementedError
@@ -1,10 +1,19 @@
 import os
+import re
 import asyncio
 import logging
 import functools
 import yt_dlp as youtube_dl
 
-from concurrent.futures import ThreadPoolExecutor
+import pickle
+import multiprocessing
+
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .config import ConfigDefaults
+from .infocache import InfoCache
+from .audiocache import AudioCache
 
 log = logging.getLogger(__name__)
 
@@ -26,6 +35,9 @@ ytdl_format_options = {
 # Fuck your useless bugreports message that gets two link embeds and confuses users
 youtube_dl.utils.bug_reports_message = lambda: ""
 
+# ytdl's search prefixes, e.g. "ytsearch:", "ytsearch5:", "scsearchall:"
+SEARCH_PREFIX = re.compile(r"^[a-z]+search(\d+|all)?:", re.IGNORECASE)
+
 """
     Alright, here's the problem.  To catch youtube-dl errors for their useful information, I have to
     catch the exceptions with `ignoreerrors` off.  To not break when ytdl hits a dumb video
@@ -35,12 +47,190 @@ youtube_dl.utils.bug_reports_message = lambda: ""
 """
 
 
+# Each extraction worker process keeps its own pair of ytdl objects for its whole life
+_worker_ytdl = {}
+
+
+def _init_process_worker(options):
+    _worker_ytdl["unsafe"] = youtube_dl.YoutubeDL(options)
+    _worker_ytdl["safe"] = youtube_dl.YoutubeDL({**options, "ignoreerrors": True})
+
+
+def _process_extract(kind, args, kwargs):
+    try:
+        return _picklable(_worker_ytdl[kind].extract_info(*args, **kwargs))
+
+    except youtube_dl.utils.DownloadError as e:
+        # The traceback can't cross the process boundary, callers only look at the type and value
+        if e.exc_info:
+            value = e.exc_info[1]
+            try:
+                pickle.dumps(value)
+            except Exception:
+                value = None
+            e.exc_info = (e.exc_info[0], value, None)
+        raise
+
+
+def _picklable(obj):
+    """
+    Turns lazily generated playlist entries (and anything else that can't be pickled) into
+    plain data so the result can be sent back from a worker process.
+    """
+    if isinstance(obj, dict):
+        return {k: _picklable(v) for k, v in obj.items()}
+
+    if obj is None or isinstance(obj, (str, bytes, int, float, bool)):
+        return obj
+
+    if isinstance(obj, youtube_dl.utils.PagedList):
+        obj = obj.getslice()
+
+    if isinstance(obj, Iterable):
+        return [_picklable(v) for v in obj]
+
+    return repr(obj)
+
+
+class WorkerLane:
+    """
+    A pool of workers dedicated to one kind of ytdl job.  Jobs can be tagged with a group (the
+    requesting guild's playlist), and a single group may never hold every worker, so one big
+    playlist import can't starve everybody else's requests.
+
+    With `process_options` the lane runs jobs in worker processes (each with its own ytdl objects)
+    instead of threads, and the processes are replaced after `recycle_after` jobs to keep ytdl's
+    memory growth in check.
+    """
+
+    def __init__(self, name, workers, *, process_options=None, recycle_after=0):
+        self.name = name
+        self.workers = workers
+        self.group_limit = max(1, workers - 1)
+        self.process_options = process_options
+        self.recycle_after = recycle_after
+
+        self.pending = 0
+        self.running = 0
+        self.jobs = 0
+        self._slots = asyncio.Semaphore(workers)
+        self._groups = {}
+
+        self.executor = self._create_executor()
+
+    @property
+    def uses_processes(self):
+        return self.process_options is not None
+
+    def _create_executor(self):
+        if not self.uses_processes:
+            return ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="ytdl-%s" % self.name
+            )
+
+        # Forking a process that's running discord's threads isn't safe, start clean ones instead
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process_worker,
+            initargs=(self.process_options,),
+        )
+
+    def _maybe_recycle(self):
+        if not self.uses_processes or not self.recycle_after:
+            return
+
+        self.jobs += 1
+        if self.jobs >= self.recycle_after:
+            log.debug(
+                "Recycling {} worker processes after {} jobs".format(
+                    self.name, self.jobs
+                )
+            )
+            # Jobs already handed to the old processes still finish there
+            self.executor.shutdown(wait=False)
+            self.executor = self._create_executor()
+            self.jobs = 0
+
+    async def run(self, loop, func, *, group=None):
+        """
+        Runs `func` on a worker once one is free.  For process lanes `func` must be picklable.
+        """
+        self.pending += 1
+        if self.pending > self.workers:
+            log.debug(
+                "{} jobs pending for {} {} workers".format(
+                    self.pending, self.workers, self.name
+                )
+            )
+
+        slot = None
+        if group is not None:
+            slot = self._groups.get(group)
+            if slot is None:
+                slot = self._groups[group] = [asyncio.Semaphore(self.group_limit), 0]
+            slot[1] += 1
+
+        try:
+            if slot:
+                await slot[0].acquire()
+
+            try:
+                async with self._slots:
+                    self.running += 1
+                    try:
+                        future = loop.run_in_executor(self.executor, func)
+                        self._maybe_recycle()
+                        return await future
+                    finally:
+                        self.running -= 1
+            finally:
+                if slot:
+                    slot[0].release()
+
+        finally:
+            self.pending -= 1
+            if slot:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._groups[group]
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.pending - self.running,
+            "groups": len(self._groups),
+            "backend": "process" if self.uses_processes else "thread",
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
 class Downloader:
-    def __init__(self, download_folder=None):
-        self.thread_pool = ThreadPoolExecutor(max_workers=2)
+    def __init__(self, download_folder=None, config=None):
+        config = config or ConfigDefaults
         self.download_folder = download_folder
 
+        self.info_cache = InfoCache(
+            ConfigDefaults.metadata_cache_file,
+            ttl=config.metadata_cache_ttl,
+            max_size=config.metadata_cache_size,
+        )
+
+        self.audio_cache = None
+        self.predownload_slots = asyncio.Semaphore(config.max_predownloads)
+
         if download_folder:
+            self.audio_cache = AudioCache(
+                download_folder,
+                ConfigDefaults.audio_cache_index_file,
+                max_size=config.audio_cache_max_size * 1024 * 1024,
+                max_age=config.audio_cache_max_age * 24 * 60 * 60,
+                policy=config.audio_cache_policy,
+            )
+
             # print("setting template to " + os.path.join(download_folder, otmpl))
             otmpl = ytdl_format_options["outtmpl"]
             ytdl_format_options["outtmpl"] = os.path.join(download_folder, otmpl)
@@ -50,23 +240,57 @@ class Downloader:
             {**ytdl_format_options, "ignoreerrors": True}
         )
 
+        process_options = None
+        if config.extraction_backend == "process":
+            process_options = dict(ytdl_format_options)
+
+        self.lanes = {
+            name: WorkerLane(
+                name,
+                workers,
+                process_options=process_options,
+                recycle_after=config.extraction_worker_recycle,
+            )
+            for name, workers in (
+                ("metadata", config.metadata_workers),
+                ("download", config.download_workers),
+                ("search", config.search_workers),
+            )
+        }
+
     @property
     def ytdl(self):
         return self.safe_ytdl
 
+    def stats(self):
+        """
+        Returns the worker and queue depth counters of every lane.
+        """
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    def _lane_for(self, args, kwargs):
+        if kwargs.get("download", True):
+            return self.lanes["download"]
+
+        if args and isinstance(args[0], str) and SEARCH_PREFIX.match(args[0]):
+            return self.lanes["search"]
+
+        return self.lanes["metadata"]
+
     async def extract_info(
-        self, loop, *args, on_error=None, retry_on_error=False, **kwargs
+        self, loop, *args, on_error=None, retry_on_error=False, group=None, **kwargs
     ):
         """
         Runs ytdl.extract_info within the threadpool. Returns a future that will fire when it's done.
         If `on_error` is passed and an exception is raised, the exception will be caught and passed to
         on_error as an argument.
+        `group` identifies who the request is for, requests of the same group are limited to a fair
+        share of the workers.
         """
         if callable(on_error):
             try:
-                return await loop.run_in_executor(
-                    self.thread_pool,
-                    functools.partial(self.unsafe_ytdl.extract_info, *args, **kwargs),
+                return await self._extract(
+                    loop, self.unsafe_ytdl, *args, group=group, **kwargs
                 )
 
             except Exception as e:
@@ -83,15 +307,47 @@ class Downloader:
                     loop.call_soon_threadsafe(on_error, e)
 
                 if retry_on_error:
-                    return await self.safe_extract_info(loop, *args, **kwargs)
+                    return await self.safe_extract_info(
+                        loop, *args, group=group, **kwargs
+                    )
         else:
-            return await loop.run_in_executor(
-                self.thread_pool,
-                functools.partial(self.unsafe_ytdl.extract_info, *args, **kwargs),
+            return await self._extract(
+                loop, self.unsafe_ytdl, *args, group=group, **kwargs
             )
 
-    async def safe_extract_info(self, loop, *args, **kwargs):
-        return await loop.run_in_executor(
-            self.thread_pool,
-            functools.partial(self.safe_ytdl.extract_info, *args, **kwargs),
+    async def safe_extract_info(self, loop, *args, group=None, **kwargs):
+        return await self._extract(loop, self.safe_ytdl, *args, group=group, **kwargs)
+
+    async def _extract(self, loop, ytdl, *args, group=None, **kwargs):
+        """
+        Runs `ytdl.extract_info` in the lane suited for the request, going through the metadata
+        cache for anything that doesn't download.  Downloads are never cached since they have side effects.
+        """
+        lane = self._lane_for(args, kwargs)
+        kind = "safe" if ytdl is self.safe_ytdl else "unsafe"
+
+        if lane.uses_processes:
+            job = functools.partial(_process_extract, kind, args, kwargs)
+        else:
+            job = functools.partial(ytdl.extract_info, *args, **kwargs)
+
+        def run():
+            return lane.run(loop, job, group=group)
+
+        if not self.info_cache.enabled or kwargs.get("download", True) or not args:
+            return await run()
+
+        # The safe ytdl returns None instead of raising, so it can't share results with the unsafe one
+        key = self.info_cache.make_key(args[0], ytdl=kind, **kwargs)
+        return await self.info_cache.get_or_extract(
+            loop, key, run, processed=kwargs.get("process", True)
         )
+
+    def shutdown(self):
+        for lane in self.lanes.values():
+            lane.shutdown()
+
+        self.info_cache.close()
+
+        if self.audio_cache:
+            self.audio_cache.save()
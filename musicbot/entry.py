@@ -2,20 +2,14 @@ import os
 import asyncio
 import logging
 import traceback
-import re
-import sys
 
 from enum import Enum
 from .constructs import Serializable
-from .exceptions import ExtractionError
+from .exceptions import ExtractionError, SongTooLongError
+from .loudness import LOUDNORM_SINGLE_PASS, loudnorm_options
+from .probe import probe
 from .utils import get_header, md5sum
 
-# optionally using pymediainfo instead of ffprobe if presents
-try:
-    import pymediainfo
-except:
-    pymediainfo = None
-
 log = logging.getLogger(__name__)
 
 
@@ -31,9 +25,23 @@ class EntryTypes(Enum):
 class BasePlaylistEntry(Serializable):
     def __init__(self):
         self.filename = None
+        self._duration = None
         self._is_downloading = False
         self._waiting_futures = []
 
+    @property
+    def duration(self):
+        return self._duration
+
+    @duration.setter
+    def duration(self, value):
+        self._duration = value
+
+        # The queue keeps track of how long it is
+        playlist = getattr(self, "playlist", None)
+        if playlist is not None:
+            playlist.duration_changed(self)
+
     @property
     def is_downloaded(self):
         if self._is_downloading:
@@ -106,6 +114,9 @@ class URLPlaylistEntry(BasePlaylistEntry):
         self.expected_filename = expected_filename
         self.meta = meta
         self.aoptions = "-vn"
+        self.codec = None
+        self.stream_url = None
+        self.stream_headers = {}
 
         self.download_folder = self.playlist.downloader.download_folder
 
@@ -136,7 +147,8 @@ class URLPlaylistEntry(BasePlaylistEntry):
         )
 
     @classmethod
-    def _deserialize(cls, data, playlist=None):
+    def _deserialize(cls, data, context):
+        playlist = context.playlist
         assert playlist is not None, cls._bad("playlist")
 
         try:
@@ -184,6 +196,37 @@ class URLPlaylistEntry(BasePlaylistEntry):
         except Exception as e:
             log.error("Could not load {}".format(cls.__name__), exc_info=e)
 
+    async def get_stream_url(self):
+        """
+        Looks up a direct url ffmpeg can play the song from while it's still being downloaded.
+        Returns None if the song is already cached, or can't be played that way.
+        """
+        if self.expected_filename and self.playlist.downloader.audio_cache.contains(
+            self.expected_filename
+        ):
+            return None
+
+        try:
+            info = await self.playlist.downloader.extract_info(
+                self.playlist.loop, self.url, download=False, group=self.playlist
+            )
+        except Exception:
+            log.debug("Could not get a stream url for {}".format(self.url), exc_info=True)
+            return None
+
+        # Songs that ytdl has to merge from separate formats, or fetch in fragments, need the download
+        if (
+            not info
+            or info.get("requested_formats")
+            or info.get("protocol", "https") not in ("http", "https")
+        ):
+            return None
+
+        self.stream_url = info.get("url", None)
+        self.stream_headers = info.get("http_headers", None) or {}
+        self.codec = info.get("acodec", None)
+        return self.stream_url
+
     # noinspection PyTypeChecker
     async def _download(self):
         if self._is_downloading:
@@ -198,16 +241,14 @@ class URLPlaylistEntry(BasePlaylistEntry):
             # self.expected_filename: audio_cache\youtube-9R8aSKwTEMg-NOMA_-_Brain_Power.m4a
             extractor = os.path.basename(self.expected_filename).split("-")[0]
 
+            cache = self.playlist.downloader.audio_cache
+            lfile, record = await self.playlist.loop.run_in_executor(
+                None, cache.lookup, self.expected_filename
+            )
+
             # the generic extractor requires special handling
             if extractor == "generic":
-                flistdir = [
-                    f.rsplit("-", 1)[0] for f in os.listdir(self.download_folder)
-                ]
-                expected_fname_noex, fname_ex = os.path.basename(
-                    self.expected_filename
-                ).rsplit(".", 1)
-
-                if expected_fname_noex in flistdir:
+                if lfile:
                     try:
                         rsize = int(
                             await get_header(
@@ -217,91 +258,58 @@ class URLPlaylistEntry(BasePlaylistEntry):
                     except:
                         rsize = 0
 
-                    lfile = os.path.join(
-                        self.download_folder,
-                        os.listdir(self.download_folder)[
-                            flistdir.index(expected_fname_noex)
-                        ],
-                    )
-
                     # print("Resolved %s to %s" % (self.expected_filename, lfile))
-                    lsize = os.path.getsize(lfile)
+                    lsize = record["size"]
                     # print("Remote size: %s Local size: %s" % (rsize, lsize))
 
                     if lsize != rsize:
-                        await self._really_download(hash=True)
+                        record = await self._really_download(hash=True)
                     else:
                         # print("[Download] Cached:", self.url)
                         self.filename = lfile
 
                 else:
                     # print("File not found in cache (%s)" % expected_fname_noex)
-                    await self._really_download(hash=True)
+                    record = await self._really_download(hash=True)
 
             else:
-                ldir = os.listdir(self.download_folder)
-                flistdir = [f.rsplit(".", 1)[0] for f in ldir]
-                expected_fname_base = os.path.basename(self.expected_filename)
-                expected_fname_noex = expected_fname_base.rsplit(".", 1)[0]
-
-                # idk wtf this is but its probably legacy code
-                # or i have youtube to blame for changing shit again
-
-                if expected_fname_base in ldir:
-                    self.filename = os.path.join(
-                        self.download_folder, expected_fname_base
-                    )
-                    log.info("Download cached: {}".format(self.url))
+                if lfile:
+                    self.filename = lfile
+                    if os.path.basename(lfile) == os.path.basename(
+                        self.expected_filename
+                    ):
+                        log.info("Download cached: {}".format(self.url))
 
-                elif expected_fname_noex in flistdir:
-                    log.info(
-                        "Download cached (different extension): {}".format(self.url)
-                    )
-                    self.filename = os.path.join(
-                        self.download_folder, ldir[flistdir.index(expected_fname_noex)]
-                    )
-                    log.debug(
-                        "Expected {}, got {}".format(
-                            self.expected_filename.rsplit(".", 1)[-1],
-                            self.filename.rsplit(".", 1)[-1],
+                    else:
+                        log.info(
+                            "Download cached (different extension): {}".format(
+                                self.url
+                            )
+                        )
+                        log.debug(
+                            "Expected {}, got {}".format(
+                                self.expected_filename.rsplit(".", 1)[-1],
+                                self.filename.rsplit(".", 1)[-1],
+                            )
                         )
-                    )
-                else:
-                    await self._really_download()
-
-            if self.duration == None:
-                if pymediainfo:
-                    try:
-                        mediainfo = pymediainfo.MediaInfo.parse(self.filename)
-                        self.duration = (mediainfo.tracks[0].duration) / 1000
-                    except:
-                        self.duration = None
-
                 else:
-                    args = [
-                        "ffprobe",
-                        "-i",
-                        self.filename,
-                        "-show_entries",
-                        "format=duration",
-                        "-v",
-                        "quiet",
-                        "-of",
-                        'csv="p=0"',
-                    ]
+                    record = await self._really_download()
 
-                    output = await self.run_command(" ".join(args))
-                    output = output.decode("utf-8")
+            if self.duration == None and record["duration"]:
+                self.duration = record["duration"]
+                log.debug(
+                    "Got duration of {} as {} seconds from the audio cache".format(
+                        self.filename, self.duration
+                    )
+                )
 
-                    try:
-                        self.duration = float(output)
-                    except ValueError:
-                        # @TheerapakG: If somehow it is not string of float
-                        self.duration = None
+            if self.duration == None:
+                probed = await probe(self.filename, self.playlist.loop)
+                self.duration = probed["duration"]
 
                 if not self.duration:
                     log.error(
-                        "Cannot extract duration of downloaded entry, invalid output from ffprobe or pymediainfo. "
+                        "Cannot extract duration of downloaded entry, could not read it from the file or ffprobe. "
                         "This does not affect the ability of the bot. However, estimated time for this entry "
                         "will not be unavailable and estimated time of the queue will also not be available "
                         "until this entry got removed.\n"
@@ -313,16 +321,37 @@ class URLPlaylistEntry(BasePlaylistEntry):
                             self.filename, self.duration
                         )
                     )
+                    cache.update(
+                        self.filename,
+                        duration=self.duration,
+                        codec=record.get("codec", None) or probed["codec"],
+                        sample_rate=record.get("sample_rate", None)
+                        or probed["sample_rate"],
+                    )
+                    record["codec"] = record.get("codec", None) or probed["codec"]
+
+            self.codec = record.get("codec", None)
+            if self.codec is None and self.playlist.bot.config.opus_passthrough:
+                probed = await probe(self.filename, self.playlist.loop)
+                self.codec = probed["codec"]
+                cache.update(
+                    self.filename,
+                    codec=self.codec,
+                    sample_rate=probed["sample_rate"],
+                )
 
             if self.playlist.bot.config.use_experimental_equalization:
-                try:
-                    aoptions = await self.get_mean_volume(self.filename)
-                except Exception as e:
-                    log.error(
-                        "There as a problem with working out EQ, likely caused by a strange installation of FFmpeg. "
-                        "This has not impacted the ability for the bot to work, but will mean your tracks will not be equalised."
-                    )
-                    aoptions = "-vn"
+                loudness = record.get("loudness", None)
+                if loudness:
+                    log.debug("Using cached loudness of {}".format(self.filename))
+                    aoptions = loudnorm_options(loudness)
+
+                else:
+                    # Measuring it takes a full decode, so don't make playback wait for it
+                    aoptions = LOUDNORM_SINGLE_PASS
+                    self.playlist.bot.loudness_analyzer.analyze(
+                        self.filename
+                    ).add_done_callback(self._loudness_measured)
             else:
                 aoptions = "-vn"
 
@@ -338,106 +367,22 @@ class URLPlaylistEntry(BasePlaylistEntry):
         finally:
             self._is_downloading = False
 
-    async def run_command(self, cmd):
-        p = await asyncio.create_subprocess_shell(
-            cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        log.debug("Starting asyncio subprocess ({0}) with command: {1}".format(p, cmd))
-        stdout, stderr = await p.communicate()
-        return stdout + stderr
-
-    def get(self, program):
-        def is_exe(fpath):
-            found = os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-            if not found and sys.platform == "win32":
-                fpath = fpath + ".exe"
-                found = os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-            return found
-
-        fpath, __ = os.path.split(program)
-        if fpath:
-            if is_exe(program):
-                return program
-        else:
-            for path in os.environ["PATH"].split(os.pathsep):
-                path = path.strip('"')
-                exe_file = os.path.join(path, program)
-                if is_exe(exe_file):
-                    return exe_file
-
-        return None
-
-    async def get_mean_volume(self, input_file):
-        log.debug("Calculating mean volume of {0}".format(input_file))
-        cmd = (
-            '"'
-            + self.get("ffmpeg")
-            + '" -i "'
-            + input_file
-            + '" -af loudnorm=I=-24.0:LRA=7.0:TP=-2.0:linear=true:print_format=json -f null /dev/null'
-        )
-        output = await self.run_command(cmd)
-        output = output.decode("utf-8")
-        log.debug(output)
-        # print('----', output)
-
-        I_matches = re.findall(r'"input_i" : "([-]?([0-9]*\.[0-9]+))",', output)
-        if I_matches:
-            log.debug("I_matches={}".format(I_matches[0][0]))
-            I = float(I_matches[0][0])
-        else:
-            log.debug("Could not parse I in normalise json.")
-            I = float(0)
-
-        LRA_matches = re.findall(r'"input_lra" : "([-]?([0-9]*\.[0-9]+))",', output)
-        if LRA_matches:
-            log.debug("LRA_matches={}".format(LRA_matches[0][0]))
-            LRA = float(LRA_matches[0][0])
-        else:
-            log.debug("Could not parse LRA in normalise json.")
-            LRA = float(0)
-
-        TP_matches = re.findall(r'"input_tp" : "([-]?([0-9]*\.[0-9]+))",', output)
-        if TP_matches:
-            log.debug("TP_matches={}".format(TP_matches[0][0]))
-            TP = float(TP_matches[0][0])
-        else:
-            log.debug("Could not parse TP in normalise json.")
-            TP = float(0)
-
-        thresh_matches = re.findall(
-            r'"input_thresh" : "([-]?([0-9]*\.[0-9]+))",', output
-        )
-        if thresh_matches:
-            log.debug("thresh_matches={}".format(thresh_matches[0][0]))
-            thresh = float(thresh_matches[0][0])
-        else:
-            log.debug("Could not parse thresh in normalise json.")
-            thresh = float(0)
-
-        offset_matches = re.findall(
-            r'"target_offset" : "([-]?([0-9]*\.[0-9]+))', output
-        )
-        if offset_matches:
-            log.debug("offset_matches={}".format(offset_matches[0][0]))
-            offset = float(offset_matches[0][0])
-        else:
-            log.debug("Could not parse offset in normalise json.")
-            offset = float(0)
-
-        return "-af loudnorm=I=-24.0:LRA=7.0:TP=-2.0:linear=true:measured_I={}:measured_LRA={}:measured_TP={}:measured_thresh={}:offset={}".format(
-            I, LRA, TP, thresh, offset
-        )
+    def _loudness_measured(self, future):
+        if not future.cancelled() and not future.exception():
+            self.aoptions = loudnorm_options(future.result())
 
     # noinspection PyShadowingBuiltins
     async def _really_download(self, *, hash=False):
+        """
+        Downloads the song and adds it to the audio cache, returning its cache record.
+        """
         log.info("Download started: {}".format(self.url))
 
         retry = True
         while retry:
             try:
                 result = await self.playlist.downloader.extract_info(
-                    self.playlist.loop, self.url, download=True
+                    self.playlist.loop, self.url, download=True, group=self.playlist
                 )
                 break
             except Exception as e:
@@ -467,6 +412,107 @@ class URLPlaylistEntry(BasePlaylistEntry):
                 # Move the temporary file to it's final location.
                 os.rename(unhashed_fname, self.filename)
 
+        # ytdl usually knows these already, which saves probing the file for them
+        return self.playlist.downloader.audio_cache.add(
+            self.filename,
+            url=self.url,
+            duration=result.get("duration", None) or None,
+            codec=result.get("acodec", None),
+            sample_rate=result.get("asr", None),
+        )
+
+
+class LazyURLPlaylistEntry(URLPlaylistEntry):
+    """
+    An entry that only knows the url (and maybe the title and duration) of a song from a
+    flat playlist. The rest of its metadata is looked up the first time it's needed,
+    which is usually when it gets close to the front of the queue.
+    """
+
+    def __init__(
+        self, playlist, url, title=None, duration=None, expected_filename=None, **meta
+    ):
+        super().__init__(
+            playlist, url, title or url, duration, expected_filename, **meta
+        )
+
+        self._resolving = None
+
+    @property
+    def is_resolved(self):
+        return self.expected_filename is not None
+
+    async def resolve(self):
+        """
+        Looks up the full metadata of the entry, if that hasn't been done yet.
+        """
+        if self.is_resolved:
+            return self
+
+        if self._resolving is None:
+            self._resolving = asyncio.ensure_future(self._resolve())
+
+        try:
+            await asyncio.shield(self._resolving)
+        finally:
+            if self._resolving is not None and self._resolving.done():
+                self._resolving = None
+
+        return self
+
+    async def _resolve(self):
+        try:
+            info = await self.playlist.downloader.extract_info(
+                self.playlist.loop, self.url, download=False, group=self.playlist
+            )
+        except Exception as e:
+            raise ExtractionError(
+                "Could not extract information from {}\n\n{}".format(self.url, e)
+            )
+
+        if not info:
+            raise ExtractionError("Could not extract information from %s" % self.url)
+
+        if info.get("_type", None) == "playlist":
+            raise ExtractionError("%s is a playlist, not a song" % self.url)
+
+        self.title = info.get("title", None) or self.title
+        self.duration = info.get("duration", None) or self.duration
+
+        # Songs from playlists that didn't know their length couldn't be checked when queued
+        max_song_length = self._max_song_length()
+        if max_song_length and self.duration and self.duration > max_song_length:
+            raise SongTooLongError(
+                "{} is longer than the max song length ({}s)".format(
+                    self.url, max_song_length
+                )
+            )
+
+        self.expected_filename = self.playlist.downloader.ytdl.prepare_filename(info)
+
+        log.debug("Resolved lazy entry {}".format(self.url))
+
+    def _max_song_length(self):
+        author = self.meta.get("author", None)
+        if not author:
+            return 0
+
+        return self.playlist.bot.permissions.for_user(author).max_song_length
+
+    async def _download(self):
+        if self._is_downloading:
+            return
+
+        if not self.is_resolved:
+            try:
+                await self.resolve()
+            except Exception as e:
+                traceback.print_exc()
+                self._for_each_future(lambda future: future.set_exception(e))
+                return
+
+        await super()._download()
+
 
 class StreamPlaylistEntry(BasePlaylistEntry):
     def __init__(self, playlist, url, title, *, destination=None, **meta):
@@ -503,7 +549,8 @@ class StreamPlaylistEntry(BasePlaylistEntry):
         )
 
     @classmethod
-    def _deserialize(cls, data, playlist=None):
+    def _deserialize(cls, data, context):
+        playlist = context.playlist
         assert playlist is not None, cls._bad("playlist")
 
         try:
@@ -540,7 +587,7 @@ class StreamPlaylistEntry(BasePlaylistEntry):
 
         try:
             result = await self.playlist.downloader.extract_info(
-                self.playlist.loop, url, download=False
+                self.playlist.loop, url, download=False, group=self.playlist
             )
         except Exception as e:
             if not fallback and self.destination:
@@ -27,6 +27,11 @@ class ExtractionError(MusicbotException):
     pass
 
 
+# A song is longer than the person who queued it is allowed to queue
+class SongTooLongError(ExtractionError):
+    pass
+
+
 # Something is wrong about data
 class InvalidDataError(MusicbotException):
     pass
@@ -0,0 +1,250 @@
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+log = logging.getLogger(__name__)
+
+# Per-extractor ceilings (in seconds) for how long an extraction result is trusted.
+# Processed results carry direct media urls that expire, and anything generic or
+# live changes under us, so those get a much shorter life than the configured TTL.
+EXTRACTOR_TTLS = {
+    "generic": 300,
+    "youtube:search": 600,
+    "youtube:tab": 1800,
+    "youtube:playlist": 1800,
+    "twitch:stream": 0,
+}
+
+# How long processed results with direct media urls are trusted when the urls don't say
+# when they expire, and how long before they do expire they're no longer trusted.
+MEDIA_URL_TTL = 1800
+MEDIA_URL_MARGIN = 600
+
+# The expiry time of direct media urls, like googlevideo's "expire=" parameter
+MEDIA_URL_EXPIRE = re.compile(r"[?&/]expire[=/](\d+)")
+
+
+def normalize_url(url):
+    """
+    Reduces a url to a stable form so trivially different spellings share a cache slot.
+    Search strings and other non-http inputs are only stripped.
+    """
+    url = url.strip()
+    parts = urlsplit(url)
+
+    if parts.scheme.lower() not in ("http", "https"):
+        return url
+
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path, query, "")
+    )
+
+
+def _media_urls(info):
+    if info.get("url"):
+        yield info["url"]
+
+    for fmt in info.get("formats") or ():
+        if fmt.get("url"):
+            yield fmt["url"]
+
+    for entry in info.get("entries") or ():
+        if isinstance(entry, dict):
+            yield from _media_urls(entry)
+
+
+class InfoCache:
+    """
+    Two tier (memory LRU + sqlite) cache for ytdl extraction results.
+
+    Results are stored as json so every hit hands out a fresh copy that callers are free
+    to mutate. Concurrent lookups of the same key share a single extraction.
+    """
+
+    def __init__(self, filename=None, *, ttl=3600, max_size=500):
+        self.filename = filename
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._db = None
+        self._db_lock = threading.Lock()
+
+        if filename and ttl > 0:
+            try:
+                self._db = sqlite3.connect(filename, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS info "
+                    "(key TEXT PRIMARY KEY, expires REAL, extractor TEXT, data TEXT)"
+                )
+                self._db.execute("DELETE FROM info WHERE expires < ?", (time.time(),))
+                self._db.commit()
+            except sqlite3.Error:
+                log.warning(
+                    "Could not open metadata cache {}, only caching in memory".format(
+                        filename
+                    ),
+                    exc_info=True,
+                )
+                self._db = None
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    @staticmethod
+    def make_key(url, **kwargs):
+        return "{}|{}".format(normalize_url(url), json.dumps(kwargs, sort_keys=True))
+
+    def ttl_for(self, info, processed=True):
+        if info.get("is_live"):
+            return 0
+
+        extractor = (info.get("extractor") or "").lower()
+        ttl = min(EXTRACTOR_TTLS.get(extractor, self.ttl), self.ttl)
+
+        urls = list(_media_urls(info))
+        if processed and urls:
+            ttl = min(ttl, MEDIA_URL_TTL)
+
+        expires = [int(m.group(1)) for m in map(MEDIA_URL_EXPIRE.search, urls) if m]
+        if expires:
+            ttl = min(ttl, min(expires) - time.time() - MEDIA_URL_MARGIN)
+
+        return ttl
+
+    async def get_or_extract(self, loop, key, extract, *, processed=True):
+        """
+        Returns the cached result for `key`, or awaits `extract()` to produce one.
+        Only one extraction per key runs at a time, everybody else waits on it.
+        `processed` tells if the result has gone through ytdl's processing, which picks the
+        direct media urls that expire.
+        """
+        data = await self._get(loop, key)
+        if data is not None:
+            log.debug("Metadata cache hit: {}".format(key))
+            return json.loads(data)
+
+        if key in self._inflight:
+            try:
+                return json.loads(await asyncio.shield(self._inflight[key]))
+            except _Uncacheable:
+                return await extract()
+
+        future = loop.create_future()
+        self._inflight[key] = future
+        try:
+            info = await extract()
+            data = self._dump(info)
+            if data is None:
+                future.set_exception(_Uncacheable())
+                return info
+
+            future.set_result(data)
+            await self._put(loop, key, data, info, processed)
+            return info
+
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+
+        finally:
+            del self._inflight[key]
+            # Nobody else may have been waiting on it, don't let asyncio complain about that.
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    @staticmethod
+    def _dump(info):
+        # Lazily generated playlist entries can't be stored (and storing them would consume them)
+        if not isinstance(info, dict) or not isinstance(
+            info.get("entries", []), list
+        ):
+            return None
+
+        try:
+            return json.dumps(info)
+        except (TypeError, ValueError):
+            return None
+
+    async def _get(self, loop, key):
+        now = time.time()
+
+        cached = self._memory.get(key)
+        if cached:
+            expires, data = cached
+            if expires > now:
+                self._memory.move_to_end(key)
+                return data
+
+            del self._memory[key]
+
+        if self._db is None:
+            return None
+
+        row = await loop.run_in_executor(None, self._db_get, key)
+        if row and row[0] > now:
+            self._remember(key, row[0], row[1])
+            return row[1]
+
+        return None
+
+    async def _put(self, loop, key, data, info, processed):
+        ttl = self.ttl_for(info, processed)
+        if ttl <= 0:
+            return
+
+        expires = time.time() + ttl
+        self._remember(key, expires, data)
+
+        if self._db is not None:
+            await loop.run_in_executor(
+                None, self._db_put, key, expires, info.get("extractor"), data
+            )
+
+    def _remember(self, key, expires, data):
+        self._memory[key] = (expires, data)
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _db_get(self, key):
+        with self._db_lock:
+            try:
+                return self._db.execute(
+                    "SELECT expires, data FROM info WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                log.debug("Error reading metadata cache", exc_info=True)
+
+    def _db_put(self, key, expires, extractor, data):
+        with self._db_lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO info VALUES (?, ?, ?, ?)",
+                    (key, expires, extractor, data),
+                )
+                self._db.commit()
+            except sqlite3.Error:
+                log.debug("Error writing metadata cache", exc_info=True)
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+
+class _Uncacheable(Exception):
+    pass
@@ -0,0 +1,313 @@
+import random
+
+
+class _Node:
+    __slots__ = (
+        "value",
+        "priority",
+        "size",
+        "weight",
+        "unknown",
+        "total",
+        "unknowns",
+        "left",
+        "right",
+        "parent",
+    )
+
+    def __init__(self, value, weight):
+        self.value = value
+        self.priority = random.random()
+        self.size = 1
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.weigh(weight)
+
+    def weigh(self, weight):
+        self.unknown = weight is None
+        self.weight = 0 if self.unknown else weight
+        self.total = self.weight
+        self.unknowns = int(self.unknown)
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _update(node):
+    node.size = 1
+    node.total = node.weight
+    node.unknowns = int(node.unknown)
+
+    for child in (node.left, node.right):
+        if child:
+            child.parent = node
+            node.size += child.size
+            node.total += child.total
+            node.unknowns += child.unknowns
+
+
+def _split(node, count):
+    """
+    Splits the tree at `node` into one with its first `count` items, and one with the rest.
+    """
+    if node is None:
+        return None, None
+
+    if _size(node.left) >= count:
+        left, node.left = _split(node.left, count)
+        _update(node)
+        return left, node
+
+    node.right, right = _split(node.right, count - _size(node.left) - 1)
+    _update(node)
+    return node, right
+
+
+def _merge(left, right):
+    """
+    Joins two trees, with every item of `left` coming before every item of `right`.
+    """
+    if left is None:
+        return right
+    if right is None:
+        return left
+
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+class IndexedDeque:
+    """
+    A sequence with the interface of a deque, that also gets, inserts and deletes items at any
+    position in O(log n) time, instead of the O(n) it takes a deque away from its ends.
+
+    It's kept as a treap ordered by position, where every node knows the size of its subtree.
+    Items are found by identity, not equality, so `index`, `remove` and `in` don't have to look
+    through the whole sequence.
+
+    If `weight` is given, the sum of the weights of the first n items (see `prefix_weight`) is
+    kept up to date too. Items can weigh None if their weight isn't known, and have to be
+    `reweigh`ed when their weight changes. If `group` is given, the amount of items in each
+    group is counted as well (see `group_count`).
+    """
+
+    def __init__(self, iterable=(), *, weight=None, group=None):
+        self._root = None
+        self._nodes = {}
+        self._version = 0
+        self._weight = weight
+        self._group = group
+        self._groups = {}
+        self.extend(iterable)
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __bool__(self):
+        return self._root is not None
+
+    def __iter__(self):
+        version = self._version
+        stack = []
+        node = self._root
+
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+
+            node = stack.pop()
+            yield node.value
+
+            if version != self._version:
+                raise RuntimeError("IndexedDeque mutated during iteration")
+            node = node.right
+
+    def __reversed__(self):
+        for index in range(len(self) - 1, -1, -1):
+            yield self[index]
+
+    def __contains__(self, value):
+        return id(value) in self._nodes
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, list(self))
+
+    def __getitem__(self, index):
+        return self._node_at(index).value
+
+    def __setitem__(self, index, value):
+        node = self._node_at(index)
+        self._forget(node)
+        node.value = value
+        self._remember(node)
+        self._reweigh_node(node)
+
+    def __delitem__(self, index):
+        self.pop(index)
+
+    def _check_index(self, index):
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("IndexedDeque index out of range")
+        return index
+
+    def _node_at(self, index):
+        index = self._check_index(index)
+
+        node = self._root
+        while True:
+            left = _size(node.left)
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node
+            else:
+                index -= left + 1
+                node = node.right
+
+    @staticmethod
+    def _rank(node):
+        index = _size(node.left)
+        while node.parent:
+            if node is node.parent.right:
+                index += _size(node.parent.left) + 1
+            node = node.parent
+        return index
+
+    def _remember(self, node):
+        self._nodes.setdefault(id(node.value), []).append(node)
+
+        if self._group:
+            group = self._group(node.value)
+            self._groups[group] = self._groups.get(group, 0) + 1
+
+    def _forget(self, node):
+        nodes = self._nodes[id(node.value)]
+        nodes.remove(node)
+        if not nodes:
+            del self._nodes[id(node.value)]
+
+        if self._group:
+            group = self._group(node.value)
+            self._groups[group] -= 1
+            if not self._groups[group]:
+                del self._groups[group]
+
+    def _weigh(self, value):
+        return self._weight(value) if self._weight else None
+
+    def _reweigh_node(self, node):
+        node.weigh(self._weigh(node.value))
+        while node:
+            _update(node)
+            node = node.parent
+
+    def _set_root(self, node):
+        if node:
+            node.parent = None
+        self._root = node
+        self._version += 1
+
+    def insert(self, index, value):
+        size = len(self)
+        if index < 0:
+            index = max(0, index + size)
+        index = min(index, size)
+
+        node = _Node(value, self._weigh(value))
+        self._remember(node)
+
+        left, right = _split(self._root, index)
+        self._set_root(_merge(_merge(left, node), right))
+
+    def append(self, value):
+        self.insert(len(self), value)
+
+    def appendleft(self, value):
+        self.insert(0, value)
+
+    def extend(self, iterable):
+        for value in iterable:
+            self.append(value)
+
+    def pop(self, index=-1):
+        if not self._root:
+            raise IndexError("pop from an empty IndexedDeque")
+        index = self._check_index(index)
+
+        left, rest = _split(self._root, index)
+        node, right = _split(rest, 1)
+        self._forget(node)
+        self._set_root(_merge(left, right))
+
+        return node.value
+
+    def popleft(self):
+        if not self._root:
+            raise IndexError("pop from an empty IndexedDeque")
+        return self.pop(0)
+
+    def index(self, value):
+        nodes = self._nodes.get(id(value))
+        if not nodes:
+            raise ValueError("{!r} is not in IndexedDeque".format(value))
+        return min(self._rank(node) for node in nodes)
+
+    def remove(self, value):
+        del self[self.index(value)]
+
+    def clear(self):
+        self._nodes.clear()
+        self._groups.clear()
+        self._set_root(None)
+
+    def reweigh(self, value):
+        """
+        Updates the weight of `value`, after it has changed.
+        """
+        for node in self._nodes.get(id(value), ()):
+            self._reweigh_node(node)
+
+    def prefix_weight(self, count=None):
+        """
+        Returns the sum of the weights of the first `count` items (or all of them), and how many
+        of those items have an unknown weight.
+        """
+        if count is None or count >= len(self):
+            node = self._root
+            return (node.total, node.unknowns) if node else (0, 0)
+
+        total = unknowns = 0
+        node = self._root
+        while node and count > 0:
+            left = _size(node.left)
+            if count <= left:
+                node = node.left
+                continue
+
+            if node.left:
+                total += node.left.total
+                unknowns += node.left.unknowns
+            total += node.weight
+            unknowns += node.unknown
+            count -= left + 1
+            node = node.right
+
+        return total, unknowns
+
+    def group_count(self, group):
+        """
+        Returns how many items are in `group`.
+        """
+        return self._groups.get(group, 0)
@@ -0,0 +1,168 @@
+import sys
+import json
+import math
+import shutil
+import asyncio
+import logging
+import subprocess
+
+log = logging.getLogger(__name__)
+
+# The measurements loudnorm reports, and the names its options take them back as
+LOUDNORM_MEASUREMENTS = {
+    "input_i": "measured_I",
+    "input_lra": "measured_LRA",
+    "input_tp": "measured_TP",
+    "input_thresh": "measured_thresh",
+    "target_offset": "offset",
+}
+
+LOUDNORM_TARGET = "loudnorm=I=-24.0:LRA=7.0:TP=-2.0"
+
+# Normalises on the fly, for songs that haven't been measured yet. Less accurate than
+# feeding loudnorm the measurements of the whole song, but it doesn't need them.
+LOUDNORM_SINGLE_PASS = "-af " + LOUDNORM_TARGET
+
+
+def parse_loudnorm(output):
+    """
+    Parses the json loudnorm prints at the end of its output into a dict of measurements.
+    Values that are missing or unreadable are measured as 0, like they always have been.
+    """
+    start = output.rfind("{")
+    end = output.find("}", start)
+    if start == -1 or end == -1:
+        raise ValueError("No loudnorm json in ffmpeg output")
+
+    stats = json.loads(output[start : end + 1])
+
+    loudness = {}
+    for name in LOUDNORM_MEASUREMENTS:
+        try:
+            loudness[name] = float(stats[name])
+            if not math.isfinite(loudness[name]):
+                raise ValueError("silence is measured as -inf")
+        except (KeyError, TypeError, ValueError):
+            log.debug("Could not parse {} in normalise json.".format(name))
+            loudness[name] = float(0)
+
+    return loudness
+
+
+def loudnorm_options(loudness):
+    """
+    Returns the ffmpeg options that normalise a song with the `loudness` measured by `parse_loudnorm`.
+    """
+    return "-af {}:linear=true:".format(LOUDNORM_TARGET) + ":".join(
+        "{}={}".format(option, loudness[name])
+        for name, option in LOUDNORM_MEASUREMENTS.items()
+    )
+
+
+class LoudnessAnalyzer:
+    """
+    Measures the loudness of downloaded songs in the background, one (or `workers`) at a time,
+    at the lowest cpu priority, so it never competes with encoding the audio that's playing.
+    Results are stored in the audio cache, where the next play of the song picks them up.
+    """
+
+    def __init__(self, audio_cache, *, workers=1, delay=1.0):
+        self.audio_cache = audio_cache
+        self.workers = workers
+        self.delay = delay
+
+        self._queue = None
+        self._jobs = {}
+
+    def analyze(self, filename):
+        """
+        Queues `filename` to be measured. Returns a future that resolves with its loudness.
+        """
+        if filename in self._jobs:
+            return self._jobs[filename]
+
+        loop = asyncio.get_event_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            for _ in range(self.workers):
+                loop.create_task(self._work())
+
+        future = loop.create_future()
+        self._jobs[filename] = future
+        self._queue.put_nowait(filename)
+
+        log.debug(
+            "Queued loudness analysis of {} ({} waiting)".format(
+                filename, self._queue.qsize()
+            )
+        )
+        return future
+
+    async def _work(self):
+        while True:
+            filename = await self._queue.get()
+            future = self._jobs[filename]
+
+            try:
+                loudness = await self.measure(filename)
+                self.audio_cache.update(filename, loudness=loudness)
+                future.set_result(loudness)
+
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+
+            except Exception as e:
+                log.error(
+                    "There as a problem with working out EQ, likely caused by a strange installation of FFmpeg. "
+                    "This has not impacted the ability for the bot to work, but will mean your tracks will not be equalised.",
+                    exc_info=True,
+                )
+                future.set_exception(e)
+                # Nobody might be waiting for it
+                future.exception()
+
+            finally:
+                del self._jobs[filename]
+
+            await asyncio.sleep(self.delay)
+
+    @staticmethod
+    async def measure(filename):
+        """
+        Measures the loudness of `filename` with ffmpeg's loudnorm filter.
+        """
+        ffmpeg = shutil.which("ffmpeg")
+        if not ffmpeg:
+            raise FileNotFoundError("ffmpeg not found")
+
+        args = [
+            ffmpeg,
+            "-nostdin",
+            "-i",
+            filename,
+            "-af",
+            LOUDNORM_TARGET + ":linear=true:print_format=json",
+            "-f",
+            "null",
+            "-",
+        ]
+        kwargs = {}
+
+        if sys.platform == "win32":
+            kwargs["creationflags"] = subprocess.IDLE_PRIORITY_CLASS
+        elif shutil.which("nice"):
+            args = ["nice", "-n", "19"] + args
+
+        log.debug("Calculating mean volume of {0}".format(filename))
+        p = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            **kwargs
+        )
+        _, stderr = await p.communicate()
+        output = stderr.decode("utf-8", "replace")
+        log.debug(output)
+
+        return parse_loudnorm(output)
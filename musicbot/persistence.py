@@ -0,0 +1,201 @@
+import os
+import json
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .constructs import Serializer
+
+log = logging.getLogger(__name__)
+
+# How many changes a queue journal holds before it's compacted into a new snapshot
+JOURNAL_COMPACT_AFTER = 1000
+
+
+def write_atomic(filename, data):
+    """
+    Writes `data` to `filename` through a temporary file, so a crash halfway through writing
+    never leaves a broken file behind.
+    """
+    tmp_file = filename + ".tmp"
+    with open(tmp_file, "w", encoding="utf8") as f:
+        f.write(data)
+    os.replace(tmp_file, filename)
+
+
+class QueuePersistence:
+    """
+    Saves the queues of servers a little while after they change, so a burst of changes (like
+    queueing a playlist) is only written once, and from a background thread so the event loop
+    never waits on the disk.
+
+    Queues are still serialized on the event loop when they're saved, since that's where
+    they're changed, only the writing happens in the background.
+    """
+
+    def __init__(self, loop, *, delay=5):
+        self.loop = loop
+        self.delay = delay
+
+        self._dirty = {}
+        self._handle = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="queue saver")
+
+    def mark_dirty(self, key, filename, serialize, write=write_atomic, on_error=None):
+        """
+        Saves the queue `key` to `filename` soon. `serialize` is called to get what to save,
+        and `write` is called with the filename and that from the background thread. If it
+        fails, `on_error` is called back on the event loop.
+        """
+        self._dirty[key] = (filename, serialize, write, on_error)
+
+        if self._handle is None:
+            self._handle = self.loop.call_later(self.delay, self.flush)
+
+    def flush(self):
+        """
+        Saves every queue that changed right away. Returns the futures of the writes.
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        dirty, self._dirty = self._dirty, {}
+        futures = []
+
+        for key, (filename, serialize, write, on_error) in dirty.items():
+            try:
+                data = serialize()
+            except Exception:
+                log.error("Could not serialize queue {}".format(key), exc_info=True)
+                continue
+
+            log.debug("Saving queue {}".format(key))
+            future = self._executor.submit(self._write, write, filename, data, on_error)
+            futures.append(future)
+
+        return futures
+
+    def _write(self, write, filename, data, on_error):
+        try:
+            write(filename, data)
+        except OSError:
+            log.warning("Could not save queue {}".format(filename), exc_info=True)
+            if on_error:
+                self.loop.call_soon_threadsafe(on_error)
+
+    def close(self):
+        """
+        Saves everything that's left, and waits for it to be written.
+        """
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+
+class QueueJournal:
+    """
+    Saves a queue as a journal instead of a whole new copy every time it changes. The journal
+    starts with a snapshot of the queue, followed by a line for every change made to it since,
+    so saving a change to a long queue only means appending a line to the file.
+
+    Once `compact_after` changes have piled up the journal is rewritten as a new snapshot,
+    which is also what's written first, so a journal never depends on what was loaded.
+    `snapshot` is called to get the "entries" of the queue, the "current" entry and its
+    "progress".
+    """
+
+    def __init__(
+        self,
+        persistence,
+        key,
+        filename,
+        snapshot,
+        *,
+        compact_after=JOURNAL_COMPACT_AFTER
+    ):
+        self.persistence = persistence
+        self.key = key
+        self.filename = filename
+        self.snapshot = snapshot
+        self.compact_after = compact_after
+
+        self._pending = []
+        self._length = 0
+        self._compact = True
+
+    def record(self, op, **data):
+        """
+        Records that the queue was changed by `op`, and saves it soon.
+        """
+        if not self._compact:
+            data["op"] = op
+            self._pending.append(json.dumps(data, cls=Serializer))
+
+            if self._length + len(self._pending) >= self.compact_after:
+                self._compact = True
+                self._pending.clear()
+
+        self._save()
+
+    def _save(self):
+        self.persistence.mark_dirty(
+            self.key, self.filename, self._drain, self._write, self._write_failed
+        )
+
+    def _drain(self):
+        if self._compact:
+            self._compact = False
+            self._length = 1
+
+            data = self.snapshot()
+            data["op"] = "snapshot"
+            return False, json.dumps(data, cls=Serializer) + "\n"
+
+        lines, self._pending = self._pending, []
+        self._length += len(lines)
+        return True, "".join(line + "\n" for line in lines)
+
+    def _write_failed(self):
+        # The file is missing changes now, so it can only be fixed by a new snapshot
+        self._compact = True
+        self._pending.clear()
+        self._save()
+
+    @staticmethod
+    def _write(filename, data):
+        append, text = data
+        if not append:
+            write_atomic(filename, text)
+        elif text:
+            with open(filename, "a", encoding="utf8") as f:
+                f.write(text)
+
+
+def replay_journal(records):
+    """
+    Works out what a queue looked like from the (deserialized) lines of its journal. Returns
+    the entries of the queue, the entry that was playing and how far into it the player got.
+    """
+    entries, current, progress = [], None, None
+
+    for record in records:
+        op = record["op"]
+
+        if op == "snapshot":
+            entries = list(record["entries"])
+            current, progress = record["current"], record["progress"]
+        elif op == "insert":
+            index = record["index"]
+            entries[index:index] = record["entries"]
+        elif op == "delete":
+            del entries[record["index"]]
+        elif op == "clear":
+            entries = []
+        elif op == "shuffle":
+            entries = [entries[i] for i in record["order"]]
+        elif op == "current":
+            current, progress = record["entry"], record["progress"]
+        else:
+            raise ValueError("Unknown queue journal record {!r}".format(op))
+
+    return entries, current, progress
@@ -1,120 +1,249 @@
 import os
 import sys
 import json
+import shlex
 import logging
 import asyncio
-import audioop
-import subprocess
 import re
+import queue
 
-from discord import FFmpegPCMAudio, PCMVolumeTransformer, AudioSource
+from discord import FFmpegPCMAudio, FFmpegOpusAudio, PCMVolumeTransformer, AudioSource
+from discord import opus
 
 from enum import Enum
-from array import array
-from threading import Thread
-from collections import deque
-from shutil import get_terminal_size
+from threading import Lock, Event, Thread
 
-from .utils import avg, _func_
+from .utils import _func_
 from .lib.event_emitter import EventEmitter
-from .constructs import Serializable, Serializer
-from .exceptions import FFmpegError, FFmpegWarning
+from .constructs import Serializable, DeserializationContext
+from .persistence import replay_journal
 from .entry import URLPlaylistEntry, StreamPlaylistEntry
 
 log = logging.getLogger(__name__)
 
+# 48kHz, 16 bit, stereo pcm, what ffmpeg decodes songs to for discord
+PCM_BYTES_PER_SECOND = 48000 * 2 * 2
+# Discord only takes opus in 20ms packets
+OPUS_PACKET_LENGTH = 0.02
 
-class PatchedBuff:
+# Have ffmpeg reconnect when it loses the connection to a song it's playing over http
+RECONNECT_OPTIONS = " -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+
+# 20ms of silence, as pcm and as an opus packet
+PCM_SILENCE = b"\0" * (PCM_BYTES_PER_SECOND // 50)
+OPUS_SILENCE = b"\xf8\xff\xfe"
+
+# How many seconds of a live stream are read ahead, and how many have to be before it's played
+STREAM_BUFFER = 5
+STREAM_PREBUFFER = 1
+# How many times in a row a live stream is reconnected to when it ends
+STREAM_RECONNECTS = 3
+# How many seconds a live stream has to play for after reconnecting to count as back to normal
+STREAM_STABLE = 30
+
+# How long before a song ends the next song's ffmpeg is started, for a gapless transition
+GAPLESS_WARM_UP = 5
+
+
+class MusicPlayerState(Enum):
+    STOPPED = 0  # When the player isn't playing anything
+    PLAYING = 1  # The player is actively playing music.
+    PAUSED = 2  # The player is paused on a song.
+    WAITING = (
+        3  # The player has finished its song but is still downloading the next one
+    )
+    DEAD = 4  # The player has been killed.
+
+    def __str__(self):
+        return self.name
+
+
+class SourcePlaybackCounter(AudioSource):
     """
-    PatchedBuff monkey patches a readable object, allowing you to vary what the volume is as the song is playing.
+    Keeps track of how far into the song playback is, from how much audio has been read.
     """
 
-    def __init__(self, buff, *, draw=False):
-        self.buff = buff
-        self.frame_count = 0
-        self.volume = 1.0
+    def __init__(self, source, offset=0):
+        self._source = source
+        self._opus = source.is_opus()
+        self._lock = Lock()
+        self._next = None
 
-        self.draw = draw
-        self.use_audioop = True
-        self.frame_skip = 2
-        self.rmss = deque([2048], maxlen=90)
+        # Where the source started from, and how much of it has been read since
+        self._offset = offset
+        self._pcm_bytes = 0
+        self._opus_packets = 0
 
-    def __del__(self):
-        if self.draw:
-            print(" " * (get_terminal_size().columns - 1), end="\r")
+    def read(self):
+        with self._lock:
+            res = self._source.read()
+            if not res and self._next:
+                res = self._hand_off()
+
+            self._opus = self._source.is_opus()
+            if self._opus:
+                self._opus_packets += bool(res)
+            else:
+                self._pcm_bytes += len(res)
+        return res
 
-    def read(self, frame_size):
-        self.frame_count += 1
+    def _hand_off(self):
+        source, is_next, on_hand_off = self._next
+        self._next = None
 
-        frame = self.buff.read(frame_size)
+        if not is_next():
+            source.cleanup()
+            return b""
 
-        if self.volume != 1:
-            frame = self._frame_vol(frame, self.volume, maxv=2)
+        old, self._source = self._source, source
+        self._move_to(0)
+        on_hand_off(old)
+        return self._source.read()
 
-        if self.draw and not self.frame_count % self.frame_skip:
-            # these should be processed for every frame, but "overhead"
-            rms = audioop.rms(frame, 2)
-            self.rmss.append(rms)
+    def _move_to(self, offset):
+        self._offset = offset
+        self._pcm_bytes = 0
+        self._opus_packets = 0
 
-            max_rms = sorted(self.rmss)[-1]
-            meter_text = "avg rms: {:.2f}, max rms: {:.2f} ".format(
-                avg(self.rmss), max_rms
-            )
-            self._pprint_meter(rms / max(1, max_rms), text=meter_text, shift=True)
+    @property
+    def progress(self):
+        """
+        How many seconds into the song playback is.
+        """
+        return (
+            self._offset
+            + self._pcm_bytes / PCM_BYTES_PER_SECOND
+            + self._opus_packets * OPUS_PACKET_LENGTH
+        )
 
-        return frame
+    def is_opus(self):
+        # Whether the last frame read was opus, the source might have been swapped since
+        return self._opus
 
-    def _frame_vol(self, frame, mult, *, maxv=2, use_audioop=True):
-        if use_audioop:
-            return audioop.mul(frame, 2, min(mult, maxv))
-        else:
-            # ffmpeg returns s16le pcm frames.
-            frame_array = array("h", frame)
+    def swap(self, source, progress=None):
+        """
+        Replaces the source being played with `source` without interrupting playback,
+        optionally moving the progress to `progress` seconds.
+        """
+        with self._lock:
+            old, self._source = self._source, source
+            if progress is not None:
+                self._move_to(progress)
+        old.cleanup()
 
-            for i in range(len(frame_array)):
-                frame_array[i] = int(frame_array[i] * min(mult, min(1, maxv)))
+    def prepare_next(self, source, is_next, on_hand_off):
+        """
+        Queues `source` to carry on from as soon as the current source runs out, without a gap.
+        `is_next` is checked right before, and `on_hand_off` is called with the finished source
+        right after. Both are called from the audio thread, so `is_next` should only check
+        something the event loop keeps up to date for it, not the queue itself.
+        """
+        self.cancel_next()
+        with self._lock:
+            self._next = (source, is_next, on_hand_off)
 
-            return frame_array.tobytes()
+    def cancel_next(self):
+        with self._lock:
+            prepared, self._next = self._next, None
+        if prepared:
+            prepared[0].cleanup()
 
-    def _pprint_meter(self, perc, *, char="#", text="", shift=True):
-        tx, ty = get_terminal_size()
+    def cleanup(self):
+        self.cancel_next()
+        self._source.cleanup()
 
-        if shift:
-            outstr = text + "{}".format(char * (int((tx - len(text)) * perc) - 1))
-        else:
-            outstr = text + "{}".format(char * (int(tx * perc) - 1))[len(text) :]
 
-        print(outstr.ljust(tx - 1), end="\r")
+class StreamBuffer(AudioSource):
+    """
+    Reads a live stream ahead on its own thread, so network hiccups are covered by what was
+    buffered, or by silence, instead of stopping playback. When the stream ends it calls
+    `reopen` (from that thread) for a new source to carry on with, if it can.
+    """
 
+    def __init__(self, source, reopen, *, size=STREAM_BUFFER, prebuffer=STREAM_PREBUFFER):
+        self._source = source
+        self._opus = source.is_opus()
+        self._reopen = reopen
+        self._frames = queue.Queue(int(size / 0.02))
+        self._prebuffer = int(prebuffer / 0.02)
+        self._buffering = True
+        self._ready = Event()
+        self._stopped = Event()
+        self._ended = False
+
+        Thread(target=self._fill, name="stream buffer", daemon=True).start()
+
+    def _fill(self):
+        reconnects = 0
+        # Frames read since the last reconnect
+        read = 0
+
+        while not self._stopped.is_set():
+            data = self._source.read()
+            if data:
+                self._put(data)
+                read += 1
+                if read >= STREAM_STABLE / 0.02:
+                    reconnects = 0
+                continue
+
+            if self._stopped.is_set() or reconnects >= STREAM_RECONNECTS:
+                break
+
+            reconnects += 1
+            read = 0
+            log.info("Stream ended, reconnecting ({})".format(reconnects))
+            self._source.cleanup()
+            try:
+                self._source = self._reopen()
+            except Exception:
+                log.warning("Could not reconnect to the stream", exc_info=True)
+                break
 
-class MusicPlayerState(Enum):
-    STOPPED = 0  # When the player isn't playing anything
-    PLAYING = 1  # The player is actively playing music.
-    PAUSED = 2  # The player is paused on a song.
-    WAITING = (
-        3  # The player has finished its song but is still downloading the next one
-    )
-    DEAD = 4  # The player has been killed.
+            if self._stopped.is_set():
+                self._source.cleanup()
 
-    def __str__(self):
-        return self.name
+        self._ended = True
+        self._ready.set()
 
+    def _put(self, data):
+        while not self._stopped.is_set():
+            try:
+                self._frames.put(data, timeout=0.5)
+            except queue.Full:
+                continue
 
-class SourcePlaybackCounter(AudioSource):
-    def __init__(self, source, progress=0):
-        self._source = source
-        self.progress = progress
+            if self._frames.qsize() >= self._prebuffer:
+                self._ready.set()
+            return
+
+    def wait_ready(self, timeout=None):
+        """
+        Blocks until enough of the stream is buffered to start playing it.
+        """
+        return self._ready.wait(timeout)
 
     def read(self):
-        res = self._source.read()
-        if res:
-            self.progress += 1
-        return res
+        if self._buffering:
+            if self._frames.qsize() < self._prebuffer and not self._ended:
+                return OPUS_SILENCE if self._opus else PCM_SILENCE
+            self._buffering = False
+
+        try:
+            return self._frames.get_nowait()
+        except queue.Empty:
+            if self._ended:
+                return b""
+
+            log.debug("Stream buffer ran out, buffering")
+            self._buffering = True
+            return OPUS_SILENCE if self._opus else PCM_SILENCE
 
-    def get_progress(self):
-        return self.progress * 0.02
+    def is_opus(self):
+        return self._opus
 
     def cleanup(self):
+        self._stopped.set()
         self._source.cleanup()
 
 
@@ -134,11 +263,15 @@ class MusicPlayer(EventEmitter, Serializable):
         self._play_lock = asyncio.Lock()
         self._current_player = None
         self._current_entry = None
-        self._stderr_future = None
+        self._ffmpeg = None
+        self._warm_up_task = None
 
         self._source = None
+        # The entry to start from where it was left off and where that was, after a restart
+        self._resume = None
 
         self.playlist.on("entry-added", self.on_entry_added)
+        self.playlist.on("entries-added", self.on_entries_added)
 
     @property
     def volume(self):
@@ -147,15 +280,28 @@ class MusicPlayer(EventEmitter, Serializable):
     @volume.setter
     def volume(self, value):
         self._volume = value
-        if self._source:
+        if not self._source:
+            return
+
+        if isinstance(self._source._source, PCMVolumeTransformer):
             self._source._source.volume = value
+        else:
+            # The volume is applied by ffmpeg (or there's no volume to change when passing
+            # opus through), so ffmpeg has to start over from where it is with the new one
+            self._restart_source()
 
     def on_entry_added(self, playlist, entry):
         if self.is_stopped:
-            self.loop.call_later(2, self.play)
+            self.loop.call_soon(self.play)
 
         self.emit("entry-added", player=self, playlist=playlist, entry=entry)
 
+    def on_entries_added(self, playlist, entries):
+        if self.is_stopped:
+            self.loop.call_soon(self.play)
+
+        self.emit("entries-added", player=self, playlist=playlist, entries=entries)
+
     def skip(self):
         self._kill_current_player()
 
@@ -196,6 +342,8 @@ class MusicPlayer(EventEmitter, Serializable):
 
     def kill(self):
         self.state = MusicPlayerState.DEAD
+        # The queue is only emptied to stop downloading it, the saved one is kept for later
+        self.playlist.journal = None
         self.playlist.clear()
         self._events.clear()
         self._kill_current_player()
@@ -209,22 +357,29 @@ class MusicPlayer(EventEmitter, Serializable):
 
         self._current_entry = None
         self._source = None
+        # This is called from the audio thread
+        self.loop.call_soon_threadsafe(self._schedule_warm_up)
 
         if error:
             self.stop()
             self.emit("error", player=self, entry=entry, ex=error)
             return
 
-        if self._stderr_future.done() and self._stderr_future.exception():
-            # I'm not sure that this would ever not be done if it gets to this point
-            # unless ffmpeg is doing something highly questionable
+        if self._ffmpeg and self._ffmpeg.error:
             self.stop()
-            self.emit(
-                "error", player=self, entry=entry, ex=self._stderr_future.exception()
-            )
+            self.emit("error", player=self, entry=entry, ex=self._ffmpeg.error)
             return
 
-        if not self.bot.config.save_videos and entry:
+        self._delete_finished(entry)
+        self.emit("finished-playing", player=self, entry=entry)
+
+    def _delete_finished(self, entry):
+        if not self.bot.config.save_videos and entry and not entry.is_downloaded:
+            # It was played from its stream url, the download it started is deleted when it lands
+            if not isinstance(entry, StreamPlaylistEntry) and entry._is_downloading:
+                self.loop.call_soon_threadsafe(self._delete_when_downloaded, entry)
+
+        elif not self.bot.config.save_videos and entry and entry.filename:
             if not isinstance(entry, StreamPlaylistEntry):
                 if any([entry.filename == e.filename for e in self.playlist.entries]):
                     log.debug(
@@ -237,41 +392,14 @@ class MusicPlayer(EventEmitter, Serializable):
                     log.debug(
                         "Deleting file: {}".format(os.path.relpath(entry.filename))
                     )
-                    filename = entry.filename
-                    for x in range(30):
-                        try:
-                            os.unlink(filename)
-                            log.debug("File deleted: {0}".format(filename))
-                            break
-                        except PermissionError as e:
-                            if e.winerror == 32:  # File is in use
-                                log.error(
-                                    "Can't delete file, it is currently in use: {0}".format(
-                                        filename
-                                    )
-                                )
-                        except FileNotFoundError:
-                            log.debug(
-                                "Could not find delete {} as it was not found. Skipping.".format(
-                                    filename
-                                ),
-                                exc_info=True,
-                            )
-                            break
-                        except Exception:
-                            log.error(
-                                "Error trying to delete {}".format(filename),
-                                exc_info=True,
-                            )
-                            break
-                    else:
-                        print(
-                            "[Config:SaveVideos] Could not delete file {}, giving up and moving on".format(
-                                os.path.relpath(filename)
-                            )
-                        )
+                    self.playlist.downloader.audio_cache.remove(entry.filename)
 
-        self.emit("finished-playing", player=self, entry=entry)
+    def _delete_when_downloaded(self, entry):
+        entry.get_ready_future().add_done_callback(
+            lambda future: future.cancelled()
+            or future.exception()
+            or self._delete_finished(entry)
+        )
 
     def _kill_current_player(self):
         if self._current_player:
@@ -300,7 +428,9 @@ class MusicPlayer(EventEmitter, Serializable):
         async with self._play_lock:
             if self.is_stopped or _continue:
                 try:
-                    entry = await self.playlist.get_next_entry()
+                    entry = await self.playlist.get_next_entry(
+                        progressive=self.bot.config.progressive_playback
+                    )
                 except:
                     log.warning("Failed to get entry, retrying", exc_info=True)
                     self.loop.call_later(0.1, self.play)
@@ -314,30 +444,19 @@ class MusicPlayer(EventEmitter, Serializable):
                 # In-case there was a player, kill it. RIP.
                 self._kill_current_player()
 
-                boptions = "-nostdin"
-                # aoptions = "-vn -b:a 192k"
-                if isinstance(entry, URLPlaylistEntry):
-                    aoptions = entry.aoptions
-                else:
-                    aoptions = "-vn"
+                offset = 0
+                if self._resume and self._resume[0] is entry:
+                    offset = self._resume[1]
+                    log.info("Resuming {} from {:.0f}s".format(entry.title, offset))
+                self._resume = None
 
-                log.ffmpeg(
-                    "Creating player with options: {} {} {}".format(
-                        boptions, aoptions, entry.filename
+                source, self._ffmpeg = self._create_source(entry, offset)
+                if isinstance(entry, StreamPlaylistEntry):
+                    await self.loop.run_in_executor(
+                        None, source.original.wait_ready, 10
                     )
-                )
 
-                self._source = SourcePlaybackCounter(
-                    PCMVolumeTransformer(
-                        FFmpegPCMAudio(
-                            entry.filename,
-                            before_options=boptions,
-                            options=aoptions,
-                            stderr=subprocess.PIPE,
-                        ),
-                        self.volume,
-                    )
-                )
+                self._source = SourcePlaybackCounter(source, offset)
                 log.debug(
                     "Playing {0} using {1}".format(self._source, self.voice_client)
                 )
@@ -349,17 +468,249 @@ class MusicPlayer(EventEmitter, Serializable):
                 self.state = MusicPlayerState.PLAYING
                 self._current_entry = entry
 
-                self._stderr_future = asyncio.Future()
+                self.emit("play", player=self, entry=entry)
+                self._schedule_warm_up()
+
+    def _create_source(self, entry, offset=0):
+        """
+        Starts ffmpeg on `entry`, `offset` seconds into it, returning the audio source to play
+        and the `FFmpegProcess` watching ffmpeg.
+        """
+        source, ffmpeg = self._start_ffmpeg(entry, offset)
+
+        if isinstance(entry, StreamPlaylistEntry):
+            source = StreamBuffer(
+                source,
+                lambda: asyncio.run_coroutine_threadsafe(
+                    self._reopen_stream(entry), self.loop
+                ).result(30),
+            )
+            # The volume is changed after the buffer, so a new volume is heard right away and
+            # never has to restart the stream
+            source = PCMVolumeTransformer(source, self.volume)
+
+        return source, ffmpeg
+
+    async def _reopen_stream(self, entry):
+        """
+        Looks `entry` up again, in case the url it was playing from has expired, and starts ffmpeg
+        on it again.
+        """
+        await entry._download()
+        source, ffmpeg = self._start_ffmpeg(entry)
+
+        if self._current_entry is entry:
+            self._ffmpeg = ffmpeg
+        return source
+
+    def _start_ffmpeg(self, entry, offset=0):
+        boptions = "-nostdin"
+        # aoptions = "-vn -b:a 192k"
+        if isinstance(entry, URLPlaylistEntry):
+            aoptions = entry.aoptions
+        else:
+            aoptions = "-vn"
+
+        if offset:
+            boptions += " -ss {:.2f}".format(offset)
+
+        if isinstance(entry, URLPlaylistEntry) and not entry.is_downloaded:
+            # Still downloading, play it straight from the source meanwhile
+            source = entry.stream_url
+            boptions += RECONNECT_OPTIONS
+            if entry.stream_headers:
+                boptions += " -headers " + shlex.quote(
+                    "".join(
+                        "{}: {}\r\n".format(name, value)
+                        for name, value in entry.stream_headers.items()
+                    )
+                )
+        else:
+            source = entry.filename
 
-                stderr_thread = Thread(
-                    target=filter_stderr,
-                    args=(self._source._source.original._process, self._stderr_future),
-                    name="stderr reader",
+        if isinstance(entry, StreamPlaylistEntry) and source.startswith("http"):
+            boptions += RECONNECT_OPTIONS
+
+        if self._can_pass_through(entry, aoptions):
+            # Already opus, so ffmpeg only has to repackage it and discord doesn't have to encode it
+            log.debug("Passing opus through for {}".format(entry.title))
+            log.ffmpeg(
+                "Creating player with options: {} {} {}".format(
+                    boptions, aoptions, source
+                )
+            )
+            return self.bot.ffmpeg_supervisor.spawn(
+                lambda stderr: FFmpegOpusAudio(
+                    source,
+                    codec="copy",
+                    before_options=boptions,
+                    options=aoptions,
+                    stderr=stderr,
                 )
+            )
 
-                stderr_thread.start()
+        # The volume of streams is changed once they're buffered, in _create_source
+        streaming = isinstance(entry, StreamPlaylistEntry)
 
-                self.emit("play", player=self, entry=entry)
+        if self.bot.config.ffmpeg_volume and not streaming:
+            aoptions = with_volume(aoptions, self.volume)
+
+        log.ffmpeg(
+            "Creating player with options: {} {} {}".format(boptions, aoptions, source)
+        )
+        source, ffmpeg = self.bot.ffmpeg_supervisor.spawn(
+            lambda stderr: FFmpegPCMAudio(
+                source, before_options=boptions, options=aoptions, stderr=stderr
+            )
+        )
+
+        if self.bot.config.ffmpeg_volume or streaming:
+            return source, ffmpeg
+        return PCMVolumeTransformer(source, self.volume), ffmpeg
+
+    def seek(self, offset):
+        """
+        Jumps to `offset` seconds into the current song. Returns whether the song could be seeked.
+        """
+        entry = self._current_entry
+        if not entry or not self._source or isinstance(entry, StreamPlaylistEntry):
+            return False
+
+        offset = max(0, offset)
+        if entry.duration:
+            offset = min(offset, entry.duration)
+
+        log.debug("Seeking to {:.2f}s in {}".format(offset, entry.title))
+        self._restart_source(offset)
+        return True
+
+    def _restart_source(self, offset=None):
+        """
+        Restarts ffmpeg at `offset` seconds into the current song, or where it is at now, to
+        change where or how it's processing the song.
+        """
+        entry = self._current_entry
+        if not entry or not self._source:
+            return
+
+        # Radio streams can't be seeked, they just carry on from wherever they are now
+        if isinstance(entry, StreamPlaylistEntry):
+            offset = None
+        elif offset is None:
+            offset = self.progress
+
+        source, self._ffmpeg = self._create_source(entry, offset or 0)
+        self._prepare_encoder(source)
+        self._source.swap(source, offset)
+
+        # The next song has to be prepared again, with the new volume or from the new position
+        self._schedule_warm_up()
+
+    def _prepare_encoder(self, source):
+        """
+        Makes sure discord can encode `source` if it's pcm. Discord only creates its encoder when
+        playback starts with pcm, but sources can change from opus to pcm while playing.
+        """
+        if not source.is_opus() and not self.voice_client.encoder:
+            self.voice_client.encoder = opus.Encoder()
+
+    def _schedule_warm_up(self):
+        """
+        (Re)starts waiting to prepare the next song, shortly before the current one ends.
+        """
+        if self._warm_up_task:
+            self._warm_up_task.cancel()
+            self._warm_up_task = None
+
+        if self._source:
+            self._source.cancel_next()
+
+        entry = self._current_entry
+        if (
+            self.bot.config.gapless_playback
+            and self._source
+            and isinstance(entry, URLPlaylistEntry)
+            and entry.duration
+        ):
+            self._warm_up_task = self.loop.create_task(
+                self._warm_up_next(entry, self._source)
+            )
+
+    async def _warm_up_next(self, entry, counter):
+        """
+        Starts ffmpeg on the next song a few seconds before `entry` ends, so the audio player
+        can carry straight on with it instead of waiting for it to be started after.
+        """
+        while True:
+            remaining = entry.duration - counter.progress
+            if remaining <= GAPLESS_WARM_UP:
+                break
+            # Woken up now and then in case of seeking or pausing
+            await asyncio.sleep(min(remaining - GAPLESS_WARM_UP, 10))
+
+        if self._source is not counter:
+            return
+
+        next_entry = self.playlist.peek()
+        if not isinstance(next_entry, URLPlaylistEntry) or not next_entry.is_downloaded:
+            # Nothing ready to carry on with, it's played the usual way once this one ends
+            return
+
+        log.debug("Warming up {} to play after {}".format(next_entry.title, entry.title))
+        source, ffmpeg = self._create_source(next_entry)
+        # Songs that are passed through as opus can be followed by ones that aren't
+        self._prepare_encoder(source)
+
+        # If the next song changes before this one ends, the prepared one is dropped
+        version = self.playlist.head_version
+        counter.prepare_next(
+            source,
+            lambda: self.playlist.head_version == version,
+            lambda old: self.loop.call_soon_threadsafe(
+                self._handed_off, counter, old, next_entry, ffmpeg
+            ),
+        )
+
+    def _handed_off(self, counter, old, entry, ffmpeg):
+        """
+        Called once the audio player has carried on with the warmed up source for `entry`.
+        """
+        old.cleanup()
+
+        try:
+            self.playlist.remove(entry)
+        except ValueError:
+            pass
+        self.playlist.resolve_upcoming()
+
+        # Skipped or stopped in the meantime
+        if self._source is not counter:
+            return
+
+        finished = self._current_entry
+        self._current_entry = entry
+        self._ffmpeg = ffmpeg
+
+        log.debug(
+            "Carried on from {} to {} without a gap".format(finished.title, entry.title)
+        )
+        self._delete_finished(finished)
+        self.emit("finished-playing", player=self, entry=finished, gapless=True)
+        self.emit("play", player=self, entry=entry)
+        self._schedule_warm_up()
+
+    def _can_pass_through(self, entry, aoptions):
+        """
+        Whether the entry can be played without decoding it: it has to be opus already, and
+        nothing (volume or filters) can need to change the audio.
+        """
+        return (
+            self.bot.config.opus_passthrough
+            and isinstance(entry, URLPlaylistEntry)
+            and entry.codec == "opus"
+            and aoptions == "-vn"
+            and self.volume == 1.0
+        )
 
     def __json__(self):
         return self._enclose_json(
@@ -368,7 +719,7 @@ class MusicPlayer(EventEmitter, Serializable):
                     "entry": self.current_entry,
                     "progress": self.progress,
                     "progress_frames": self._current_player._player.loops
-                    if self.progress is not None
+                    if self.progress is not None and self._current_player
                     else None,
                 },
                 "entries": self.playlist,
@@ -376,7 +727,10 @@ class MusicPlayer(EventEmitter, Serializable):
         )
 
     @classmethod
-    def _deserialize(cls, data, bot=None, voice_client=None, playlist=None):
+    def _deserialize(cls, data, context):
+        bot = context.bot
+        voice_client = context.voice_client
+        playlist = context.playlist
         assert bot is not None, cls._bad("bot")
         assert voice_client is not None, cls._bad("voice_client")
         assert playlist is not None, cls._bad("playlist")
@@ -388,22 +742,56 @@ class MusicPlayer(EventEmitter, Serializable):
             player.playlist.entries = data_pl.entries
 
         current_entry_data = data["current_entry"]
-        if current_entry_data["entry"]:
-            player.playlist.entries.appendleft(current_entry_data["entry"])
-            # TODO: progress stuff
-            # how do I even do this
-            # this would have to be in the entry class right?
-            # some sort of progress indicator to skip ahead with ffmpeg (however that works, reading and ignoring frames?)
+        player._restore_current_entry(
+            current_entry_data["entry"], current_entry_data.get("progress")
+        )
 
         return player
 
+    def _restore_current_entry(self, entry, progress):
+        # The song that was playing is played again first, from where it was at
+        if entry:
+            self.playlist.entries.appendleft(entry)
+
+            if progress and not isinstance(entry, StreamPlaylistEntry):
+                self._resume = (entry, progress)
+
     @classmethod
     def from_json(cls, raw_json, bot, voice_client, playlist):
         try:
-            return json.loads(raw_json, object_hook=Serializer.deserialize)
+            context = DeserializationContext(bot, voice_client, playlist)
+            return json.loads(raw_json, object_hook=context.object_hook)
         except Exception as e:
             log.exception("Failed to deserialize player", e)
 
+    @classmethod
+    def from_journal(cls, raw_journal, bot, voice_client, playlist):
+        """
+        Creates a player from a queue journal written by a `QueueJournal`.
+        """
+        context = DeserializationContext(bot, voice_client, playlist)
+
+        records = []
+        for line in raw_journal.splitlines():
+            try:
+                records.append(json.loads(line, object_hook=context.object_hook))
+            except ValueError:
+                # The bot was stopped while it was writing the last change
+                log.warning("Ignoring the end of a broken queue journal")
+                break
+
+        try:
+            entries, current_entry, progress = replay_journal(records)
+        except Exception:
+            log.exception("Failed to replay queue journal")
+            return None
+
+        player = cls(bot, voice_client, playlist)
+        player.playlist.entries = playlist._new_entries(entries)
+        player._restore_current_entry(current_entry, progress)
+
+        return player
+
     @property
     def current_entry(self):
         return self._current_entry
@@ -427,73 +815,29 @@ class MusicPlayer(EventEmitter, Serializable):
     @property
     def progress(self):
         if self._source:
-            return self._source.get_progress()
-            # TODO: Properly implement this
-            #       Correct calculation should be bytes_read/192k
-            #       192k AKA sampleRate * (bitDepth / 8) * channelCount
-            #       Change frame_count to bytes_read in the PatchedBuff
-
+            return self._source.progress
 
-# TODO: I need to add a check for if the eventloop is closed
 
+def with_volume(aoptions, volume):
+    """
+    Adds a volume filter to the end of the audio filters in the ffmpeg options `aoptions`.
+    """
+    if volume == 1.0:
+        return aoptions
 
-def filter_stderr(popen: subprocess.Popen, future: asyncio.Future):
-    last_ex = None
+    args = shlex.split(aoptions)
+    volume = "volume={:.3f}".format(volume)
 
-    while True:
-        data = popen.stderr.readline()
-        if data:
-            log.ffmpeg("Data from ffmpeg: {}".format(data))
-            try:
-                if check_stderr(data):
-                    sys.stderr.buffer.write(data)
-                    sys.stderr.buffer.flush()
+    if "-af" in args:
+        index = args.index("-af") + 1
+        args[index] += "," + volume
+    else:
+        args += ["-af", volume]
 
-            except FFmpegError as e:
-                log.ffmpeg("Error from ffmpeg: %s", str(e).strip())
-                last_ex = e
+    return " ".join(shlex.quote(arg) for arg in args)
 
-            except FFmpegWarning:
-                pass  # useless message
-        else:
-            break
 
-    if last_ex:
-        future.set_exception(last_ex)
-    else:
-        future.set_result(True)
-
-
-def check_stderr(data: bytes):
-    try:
-        data = data.decode("utf8")
-    except:
-        log.ffmpeg("Unknown error decoding message from ffmpeg", exc_info=True)
-        return True  # fuck it
-
-    # log.ffmpeg("Decoded data from ffmpeg: {}".format(data))
-
-    # TODO: Regex
-    warnings = [
-        "Header missing",
-        "Estimating duration from birate, this may be inaccurate",
-        "Using AVStream.codec to pass codec parameters to muxers is deprecated, use AVStream.codecpar instead.",
-        "Application provided invalid, non monotonically increasing dts to muxer in stream",
-        "Last message repeated",
-        "Failed to send close message",
-        "decode_band_types: Input buffer exhausted before END element found",
-    ]
-    errors = [
-        "Invalid data found when processing input",  # need to regex this properly, its both a warning and an error
-    ]
-
-    if any(msg in data for msg in warnings):
-        raise FFmpegWarning(data)
-
-    if any(msg in data for msg in errors):
-        raise FFmpegError(data)
-
-    return True
+# TODO: I need to add a check for if the eventloop is closed
 
 
 # if redistributing ffmpeg is an issue, it can be downloaded from here:
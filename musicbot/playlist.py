@@ -1,10 +1,11 @@
 import os.path
+import asyncio
 import logging
 import datetime
 
 from random import shuffle
+from weakref import WeakSet
 from itertools import islice
-from collections import deque
 from urllib.error import URLError
 
 # For the time being, youtube_dl is often slow and inconsistent
@@ -14,8 +15,14 @@ from yt_dlp.utils import ExtractorError, DownloadError, UnsupportedError
 from .utils import get_header
 from .constructs import Serializable
 from .lib.event_emitter import EventEmitter
-from .entry import URLPlaylistEntry, StreamPlaylistEntry
-from .exceptions import ExtractionError, WrongEntryTypeError, InvalidDataError
+from .lib.indexed_deque import IndexedDeque
+from .entry import URLPlaylistEntry, LazyURLPlaylistEntry, StreamPlaylistEntry
+from .exceptions import (
+    ExtractionError,
+    WrongEntryTypeError,
+    InvalidDataError,
+    SongTooLongError,
+)
 
 log = logging.getLogger(__name__)
 
@@ -30,7 +37,24 @@ class Playlist(EventEmitter, Serializable):
         self.bot = bot
         self.loop = bot.loop
         self.downloader = bot.downloader
-        self.entries = deque()
+        self.entries = self._new_entries()
+        self._predownloads = {}
+        self._predownload_failed = WeakSet()
+
+        # A QueueJournal to record changes to the queue in, if queues are journaled
+        self.journal = None
+        # Goes up whenever the next entry might have changed, so whatever was prepared for it
+        # can tell it's out of date without looking at the queue
+        self.head_version = 0
+
+    @staticmethod
+    def _new_entries(entries=()):
+        # Keeps track of how long the queue is, and how many songs each user has queued
+        return IndexedDeque(
+            entries,
+            weight=lambda entry: entry.duration,
+            group=lambda entry: entry.meta.get("author", None),
+        )
 
     def __iter__(self):
         return iter(self.entries)
@@ -38,22 +62,37 @@ class Playlist(EventEmitter, Serializable):
     def __len__(self):
         return len(self.entries)
 
+    def _record(self, op, **data):
+        if op in ("shuffle", "clear") or data.get("index") == 0:
+            self.head_version += 1
+
+        if self.journal:
+            self.journal.record(op, **data)
+
+    def _normalize_index(self, index):
+        return index + len(self.entries) if index < 0 else index
+
     def shuffle(self):
-        shuffle(self.entries)
+        entries = list(self.entries)
+        order = list(range(len(entries)))
+        shuffle(order)
+        self.entries = self._new_entries(entries[i] for i in order)
+        self._record("shuffle", order=order)
+        self.predownload()
 
     def clear(self):
         self.entries.clear()
+        self._record("clear")
+        self.predownload()
 
     def get_entry_at_index(self, index):
-        self.entries.rotate(-index)
-        entry = self.entries[0]
-        self.entries.rotate(index)
-        return entry
+        return self.entries[index]
 
     def delete_entry_at_index(self, index):
-        self.entries.rotate(-index)
-        entry = self.entries.popleft()
-        self.entries.rotate(index)
+        index = self._normalize_index(index)
+        entry = self.entries.pop(index)
+        self._record("delete", index=index)
+        self.predownload()
         return entry
 
     async def add_entry(self, song_url, *, head, **meta):
@@ -66,9 +105,23 @@ class Playlist(EventEmitter, Serializable):
         :param meta: Any additional metadata to add to the playlist entry.
         """
 
+        entry = await self._create_entry(song_url, **meta)
+
+        if isinstance(entry, StreamPlaylistEntry):
+            self._add_entry(entry)
+            return entry, len(self.entries)
+
+        self._add_entry(entry, head=head)
+        return entry, (1 if head else len(self.entries))
+
+    async def _create_entry(self, song_url, **meta):
+        """
+        Validates `song_url` and builds the entry for it, without adding it to the playlist.
+        """
+
         try:
             info = await self.downloader.extract_info(
-                self.loop, song_url, download=False
+                self.loop, song_url, download=False, group=self
             )
         except Exception as e:
             raise ExtractionError(
@@ -87,7 +140,7 @@ class Playlist(EventEmitter, Serializable):
             )
 
         if info.get("is_live", False):
-            return await self.add_stream_entry(song_url, info=info, **meta)
+            return await self._create_stream_entry(song_url, info=info, **meta)
 
         # TODO: Extract this to its own function
         if info["extractor"] in ["generic", "Dropbox"]:
@@ -118,7 +171,7 @@ class Playlist(EventEmitter, Serializable):
                     log.warning(
                         "Got text/html for content-type, this might be a stream."
                     )
-                    return await self.add_stream_entry(
+                    return await self._create_stream_entry(
                         song_url, info=info, **meta
                     )  # TODO: Check for shoutcast/icecast
 
@@ -129,7 +182,7 @@ class Playlist(EventEmitter, Serializable):
                         )
                     )
 
-        entry = URLPlaylistEntry(
+        return URLPlaylistEntry(
             self,
             song_url,
             info.get("title", "Untitled"),
@@ -137,16 +190,19 @@ class Playlist(EventEmitter, Serializable):
             self.downloader.ytdl.prepare_filename(info),
             **meta
         )
-        self._add_entry(entry, head=head)
-        return entry, (1 if head else len(self.entries))
 
     async def add_stream_entry(self, song_url, info=None, **meta):
+        entry = await self._create_stream_entry(song_url, info=info, **meta)
+        self._add_entry(entry)
+        return entry, len(self.entries)
+
+    async def _create_stream_entry(self, song_url, info=None, **meta):
         if info is None:
             info = {"title": song_url, "extractor": None}
 
             try:
                 info = await self.downloader.extract_info(
-                    self.loop, song_url, download=False
+                    self.loop, song_url, download=False, group=self
                 )
 
             except DownloadError as e:
@@ -198,14 +254,15 @@ class Playlist(EventEmitter, Serializable):
 
         # TODO: A bit more validation, "~stream some_url" should not just say :ok_hand:
 
-        entry = StreamPlaylistEntry(self, song_url, title, destination=dest_url, **meta)
-        self._add_entry(entry)
-        return entry, len(self.entries)
+        return StreamPlaylistEntry(self, song_url, title, destination=dest_url, **meta)
 
     async def import_from(self, playlist_url, head, **meta):
         """
         Imports the songs from `playlist_url` and queues them to be played.
 
+        With LazyPlaylists only the flat playlist is extracted, each song is queued as a lazy
+        entry that looks up the rest of its information once it's needed.
+
         Returns a list of `entries` that have been enqueued.
 
         :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
@@ -213,20 +270,12 @@ class Playlist(EventEmitter, Serializable):
         """
         position = 1 if head else len(self.entries) + 1
         entry_list = []
+        lazy = self.bot.config.lazy_playlists
 
-        try:
-            info = await self.downloader.safe_extract_info(
-                self.loop, playlist_url, download=False
-            )
-        except Exception as e:
-            raise ExtractionError(
-                "Could not extract information from {}\n\n{}".format(playlist_url, e)
-            )
+        info = await self._extract_playlist_info(playlist_url, process=not lazy)
 
-        if not info:
-            raise ExtractionError(
-                "Could not extract information from %s" % playlist_url
-            )
+        if "entries" not in info:
+            raise ExtractionError("%s is not a playlist" % playlist_url)
 
         # Once again, the generic extractor fucks things up.
         if info.get("extractor", None) == "generic":
@@ -235,22 +284,27 @@ class Playlist(EventEmitter, Serializable):
             url_field = "webpage_url"
 
         baditems = 0
-        entries = list(info["entries"])
-        if head:
-            entries.reverse()
         for item in info["entries"]:
-            if item:
+            song_url = item and (item.get(url_field, None) or item.get("url", None))
+            if song_url:
                 try:
-                    entry = URLPlaylistEntry(
-                        self,
-                        item[url_field],
-                        item.get("title", "Untitled"),
-                        item.get("duration", 0) or 0,
-                        self.downloader.ytdl.prepare_filename(item),
-                        **meta
-                    )
-
-                    self._add_entry(entry, head=head)
+                    if lazy:
+                        entry = LazyURLPlaylistEntry(
+                            self,
+                            song_url,
+                            item.get("title", None),
+                            item.get("duration", None) or None,
+                            **meta
+                        )
+                    else:
+                        entry = URLPlaylistEntry(
+                            self,
+                            song_url,
+                            item.get("title", "Untitled"),
+                            item.get("duration", None) or None,
+                            self.downloader.ytdl.prepare_filename(item),
+                            **meta
+                        )
                     entry_list.append(entry)
                 except Exception as e:
                     baditems += 1
@@ -262,76 +316,58 @@ class Playlist(EventEmitter, Serializable):
         if baditems:
             log.info("Skipped {} bad entries".format(baditems))
 
-        if head:
-            entry_list.reverse()
+        self.add_entries(entry_list, head=head)
+        self.resolve_upcoming()
+
         return entry_list, position
 
-    async def async_process_youtube_playlist(self, playlist_url, *, head, **meta):
+    async def async_process_youtube_playlist(
+        self, playlist_url, *, head=False, on_progress=None, **meta
+    ):
         """
         Processes youtube playlists links from `playlist_url` in a questionable, async fashion.
 
         :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+        :param on_progress: Called with (processed, total) as songs are processed
         :param meta: Any additional metadata to add to the playlist entry
         """
 
-        try:
-            info = await self.downloader.safe_extract_info(
-                self.loop, playlist_url, download=False, process=False
-            )
-        except Exception as e:
-            raise ExtractionError(
-                "Could not extract information from {}\n\n{}".format(playlist_url, e)
-            )
-
-        if not info:
-            raise ExtractionError(
-                "Could not extract information from %s" % playlist_url
-            )
-
-        gooditems = []
-        baditems = 0
-
-        entries = list(info["entries"])
-        if head:
-            entries.reverse()
-        for entry_data in info["entries"]:
-            if entry_data:
-                baseurl = info["webpage_url"].split("playlist?list=")[0]
-                song_url = baseurl + "watch?v=%s" % entry_data["id"]
-
-                try:
-                    entry, elen = await self.add_entry(song_url, head=head, **meta)
-                    gooditems.append(entry)
+        info = await self._extract_playlist_info(playlist_url)
+        baseurl = info["webpage_url"].split("playlist?list=")[0]
 
-                except ExtractionError:
-                    baditems += 1
-
-                except Exception as e:
-                    baditems += 1
-                    log.error(
-                        "Error adding entry {}".format(entry_data["id"]), exc_info=e
-                    )
-            else:
-                baditems += 1
-
-        if baditems:
-            log.info("Skipped {} bad entries".format(baditems))
-
-        if head:
-            gooditems.reverse()
-        return gooditems
+        song_urls = [
+            baseurl + "watch?v=%s" % entry_data["id"] if entry_data else None
+            for entry_data in info["entries"]
+        ]
+        return await self._process_playlist_urls(
+            song_urls, head=head, on_progress=on_progress, **meta
+        )
 
-    async def async_process_sc_bc_playlist(self, playlist_url, *, head=False, **meta):
+    async def async_process_sc_bc_playlist(
+        self, playlist_url, *, head=False, on_progress=None, **meta
+    ):
         """
         Processes soundcloud set and bancdamp album links from `playlist_url` in a questionable, async fashion.
 
         :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+        :param on_progress: Called with (processed, total) as songs are processed
         :param meta: Any additional metadata to add to the playlist entry
         """
 
+        info = await self._extract_playlist_info(playlist_url)
+
+        song_urls = [
+            entry_data["url"] if entry_data else None
+            for entry_data in info["entries"]
+        ]
+        return await self._process_playlist_urls(
+            song_urls, head=head, on_progress=on_progress, **meta
+        )
+
+    async def _extract_playlist_info(self, playlist_url, process=False):
         try:
             info = await self.downloader.safe_extract_info(
-                self.loop, playlist_url, download=False, process=False
+                self.loop, playlist_url, download=False, process=process, group=self
             )
         except Exception as e:
             raise ExtractionError(
@@ -343,71 +379,285 @@ class Playlist(EventEmitter, Serializable):
                 "Could not extract information from %s" % playlist_url
             )
 
+        return info
+
+    async def _process_playlist_urls(
+        self, song_urls, *, head=False, on_progress=None, **meta
+    ):
+        """
+        Extracts `song_urls` concurrently, at most `PlaylistConcurrency` at a time, and queues every
+        entry as soon as all the songs before it are resolved, so the queue keeps the playlist's order.
+        Urls that are None or can't be extracted are skipped.
+
+        Returns the list of entries that were added, in playlist order.
+        """
+        semaphore = asyncio.Semaphore(self.bot.config.playlist_concurrency)
+        total = len(song_urls)
+        results = [None] * total
+        resolved = [False] * total
+
         gooditems = []
         baditems = 0
+        processed = 0
+        flushed = 0
 
-        entries = list(info["entries"])
-        if head:
-            entries.reverse()
-        for entry_data in info["entries"]:
-            if entry_data:
-                song_url = entry_data["url"]
+        async def resolve(index, song_url):
+            if song_url:
+                async with semaphore:
+                    try:
+                        results[index] = await self._create_entry(song_url, **meta)
 
-                try:
-                    entry, elen = await self.add_entry(song_url, head=head, **meta)
-                    gooditems.append(entry)
+                    except ExtractionError:
+                        pass
 
-                except ExtractionError:
-                    baditems += 1
+                    except Exception as e:
+                        log.error("Error adding entry {}".format(song_url), exc_info=e)
 
-                except Exception as e:
+            resolved[index] = True
+
+        def head_position():
+            # Right after the songs queued so far, some of which may have been played or removed since
+            for entry in reversed(gooditems):
+                if entry in self.entries:
+                    return self.entries.index(entry) + 1
+
+            return 0
+
+        async def report(coro):
+            nonlocal processed, flushed, baditems
+            await coro
+
+            # Queue everything that's ready without leaving a hole in the playlist order
+            ready = []
+            while flushed < total and resolved[flushed]:
+                entry = results[flushed]
+                results[flushed] = None
+                flushed += 1
+
+                if entry is None:
                     baditems += 1
-                    log.error(
-                        "Error adding entry {}".format(entry_data["id"]), exc_info=e
-                    )
-            else:
-                baditems += 1
+                else:
+                    ready.append(entry)
+
+            if ready:
+                self._insert_entries(
+                    head_position() if head else len(self.entries), ready
+                )
+                gooditems.extend(ready)
+
+            processed += 1
+            if on_progress is not None:
+                if asyncio.iscoroutinefunction(on_progress):
+                    await on_progress(processed, total)
+                else:
+                    on_progress(processed, total)
+
+        await asyncio.gather(
+            *(report(resolve(i, url)) for i, url in enumerate(song_urls))
+        )
 
         if baditems:
             log.info("Skipped {} bad entries".format(baditems))
 
-        if head:
-            gooditems.reverse()
         return gooditems
 
     def _add_entry(self, entry, *, head=False):
-        if head:
-            self.entries.appendleft(entry)
-        else:
-            self.entries.append(entry)
+        self._insert_entry(0 if head else len(self.entries), entry)
+
+    def _insert_entry(self, index, entry):
+        index = min(index, len(self.entries))
+        self.entries.insert(index, entry)
+        self._record("insert", index=index, entries=[entry])
 
         self.emit("entry-added", playlist=self, entry=entry)
 
-        if self.peek() is entry:
-            entry.get_ready_future()
+        self.predownload()
+
+    def add_entries(self, entries, *, head=False):
+        """
+        Queues `entries` in order, all at once, at the front or the end of the queue.
+        Emits a single "entries-added" event for them, instead of an "entry-added" each.
+        """
+        self._insert_entries(0 if head else len(self.entries), entries)
+
+    def _insert_entries(self, index, entries):
+        entries = list(entries)
+        if not entries:
+            return
+
+        index = min(index, len(self.entries))
+        for offset, entry in enumerate(entries):
+            self.entries.insert(index + offset, entry)
+        self._record("insert", index=index, entries=entries)
+
+        self.emit("entries-added", playlist=self, entries=entries)
+
+        self.predownload()
 
     def remove_entry(self, index):
+        index = self._normalize_index(index)
         del self.entries[index]
+        self._record("delete", index=index)
+        self.predownload()
+
+    def remove(self, entry):
+        index = self.entries.index(entry)
+        del self.entries[index]
+        self._record("delete", index=index)
+        self.predownload()
+
+    def duration_changed(self, entry):
+        if entry in self.entries:
+            self.entries.reweigh(entry)
 
-    async def get_next_entry(self, predownload_next=True):
+    async def get_next_entry(self, predownload_next=True, progressive=False):
         """
         A coroutine which will return the next song or None if no songs left to play.
 
         Additionally, if predownload_next is set to True, it will attempt to download the next
         song to be played - so that it's ready by the time we get to it.
+
+        If progressive is set to True, a song that isn't downloaded yet is returned as soon as
+        it can be played from its `stream_url`, while it keeps downloading in the background.
         """
         if not self.entries:
             return None
 
         entry = self.entries.popleft()
+        self._record("delete", index=0)
 
         if predownload_next:
-            next_entry = self.peek()
-            if next_entry:
-                next_entry.get_ready_future()
+            self.predownload()
+
+        self.resolve_upcoming()
+
+        if (
+            progressive
+            and isinstance(entry, URLPlaylistEntry)
+            and not entry.is_downloaded
+        ):
+            if isinstance(entry, LazyURLPlaylistEntry):
+                await entry.resolve()
+
+            if await entry.get_stream_url():
+                log.debug("Playing {} while it downloads".format(entry.url))
+
+                # Only worth downloading if it's going to be kept around
+                if self.bot.config.save_videos:
+                    ready = entry.get_ready_future()
+                    ready.add_done_callback(
+                        lambda future: future.cancelled() or future.exception()
+                    )
+
+                return entry
 
         return await entry.get_ready_future()
 
+    def _predownload_window(self):
+        """
+        Yields the entries that should be downloaded ahead of time: the first `PredownloadCount`,
+        and after those as many as it takes to have `PredownloadMinutes` of music ready.
+        """
+        count = self.bot.config.predownload_count
+        seconds = self.bot.config.predownload_minutes * 60
+        ahead = 0
+
+        for index, entry in enumerate(self.entries):
+            if index >= count and (ahead is None or ahead >= seconds):
+                break
+
+            yield entry
+
+            if ahead is not None and entry.duration:
+                ahead += entry.duration
+            else:
+                # Can't tell how far ahead we are anymore
+                ahead = None
+
+    def predownload(self):
+        """
+        Starts downloading the entries in the predownload window, and stops waiting to download the ones
+        that left it. The entry at the front is downloaded right away, the rest share a limited amount
+        of download slots with every other server.
+        """
+        window = set()
+
+        for index, entry in enumerate(self._predownload_window()):
+            if isinstance(entry, StreamPlaylistEntry):
+                continue
+
+            window.add(entry)
+            if (
+                entry.is_downloaded
+                or entry in self._predownloads
+                or entry in self._predownload_failed
+            ):
+                continue
+
+            if index == 0:
+                task = asyncio.ensure_future(entry.get_ready_future())
+            else:
+                task = asyncio.ensure_future(self._predownload(entry))
+
+            self._predownloads[entry] = task
+            task.add_done_callback(
+                lambda task, entry=entry: self._predownload_done(entry, task)
+            )
+
+        for entry, task in list(self._predownloads.items()):
+            if entry not in window:
+                # Downloads that have already started run to completion, since ytdl can't be
+                # interrupted, but the ones still waiting for a slot don't need to anymore.
+                task.cancel()
+
+    async def _predownload(self, entry):
+        async with self.downloader.predownload_slots:
+            log.debug("Predownloading {}".format(entry.url))
+            ready = entry.get_ready_future()
+            ready.add_done_callback(
+                lambda future: future.cancelled() or future.exception()
+            )
+
+            try:
+                await asyncio.shield(ready)
+            except asyncio.CancelledError:
+                # The download can't be interrupted, so it keeps its slot until it's done
+                while not ready.done():
+                    try:
+                        await asyncio.wait([ready])
+                    except asyncio.CancelledError:
+                        pass
+                raise
+
+    def _predownload_done(self, entry, task):
+        if self._predownloads.get(entry) is task:
+            del self._predownloads[entry]
+
+        if not task.cancelled() and task.exception():
+            # Don't keep retrying it, the player reports the error when it gets to the entry
+            log.debug("Predownload of {} failed".format(entry.url))
+            self._predownload_failed.add(entry)
+
+    def resolve_upcoming(self, count=5):
+        """
+        Starts looking up the metadata of the first `count` lazy entries that haven't been yet,
+        so their titles and durations are known by the time they're about to play.
+        """
+        for entry in islice(self.entries, count):
+            if isinstance(entry, LazyURLPlaylistEntry) and not entry.is_resolved:
+                asyncio.ensure_future(self._resolve_quietly(entry))
+
+    async def _resolve_quietly(self, entry):
+        try:
+            await entry.resolve()
+        except SongTooLongError as e:
+            log.info("Removing {} from the queue: {}".format(entry.title, e))
+            if entry in self.entries:
+                self.remove(entry)
+        except ExtractionError:
+            # Reported properly once the entry is downloaded
+            log.debug("Could not resolve {}".format(entry.url), exc_info=True)
+
     def peek(self):
         """
         Returns the next entry that should be scheduled to be played.
@@ -419,28 +669,30 @@ class Playlist(EventEmitter, Serializable):
         """
         (very) Roughly estimates the time till the queue will 'position'
         """
-        if any(e.duration == None for e in islice(self.entries, position - 1)):
+        estimated_time, unknown = self.entries.prefix_weight(position - 1)
+        if unknown:
             raise InvalidDataError("no duration data")
-        else:
-            estimated_time = sum(e.duration for e in islice(self.entries, position - 1))
 
         # When the player plays a song, it eats the first playlist item, so we just have to add the time back
         if not player.is_stopped and player.current_entry:
             if player.current_entry.duration == None:  # duration can be 0
                 raise InvalidDataError("no duration data in current entry")
             else:
-                estimated_time += player.current_entry.duration - player.progress
+                estimated_time += max(
+                    0, player.current_entry.duration - (player.progress or 0)
+                )
 
         return datetime.timedelta(seconds=estimated_time)
 
     def count_for_user(self, user):
-        return sum(1 for e in self.entries if e.meta.get("author", None) == user)
+        return self.entries.group_count(user)
 
     def __json__(self):
         return self._enclose_json({"entries": list(self.entries)})
 
     @classmethod
-    def _deserialize(cls, raw_json, bot=None):
+    def _deserialize(cls, raw_json, context):
+        bot = context.bot
         assert bot is not None, cls._bad("bot")
         # log.debug("Deserializing playlist")
         pl = cls(bot)
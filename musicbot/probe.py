@@ -0,0 +1,395 @@
+"""
+Finds out the duration and codec of downloaded songs.
+
+The containers yt-dlp usually downloads audio in (mp4/m4a, webm/matroska and ogg) are read
+directly, which only takes a few small reads of the file. Anything else is handed to
+pymediainfo if it's installed, and to ffprobe as a last resort.
+"""
+
+import os
+import json
+import shutil
+import struct
+import asyncio
+import logging
+
+# optionally using pymediainfo instead of ffprobe if presents
+try:
+    import pymediainfo
+except:
+    pymediainfo = None
+
+log = logging.getLogger(__name__)
+
+# The most ffprobe processes to run at the same time
+FFPROBE_LIMIT = 2
+
+MP4_CODECS = {"mp4a": "aac", "Opus": "opus", "fLaC": "flac", ".mp3": "mp3"}
+MATROSKA_CODECS = {"A_OPUS": "opus", "A_VORBIS": "vorbis", "A_AAC": "aac"}
+
+_ffprobe_slots = None
+
+
+class ProbeError(Exception):
+    pass
+
+
+def _result(duration=None, codec=None, sample_rate=None):
+    return {"duration": duration, "codec": codec, "sample_rate": sample_rate}
+
+
+def read_header(filename):
+    """
+    Reads the duration and codec of `filename` from its container. Returns None if the container
+    isn't one we can read.
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(12)
+        f.seek(0)
+
+        try:
+            if magic[4:8] == b"ftyp":
+                return _read_mp4(f)
+            if magic[:4] == b"\x1a\x45\xdf\xa3":
+                return _read_matroska(f)
+            if magic[:4] == b"OggS":
+                return _read_ogg(f)
+        except (ProbeError, EOFError, struct.error, ValueError) as e:
+            log.debug("Could not read the header of {}: {}".format(filename, e))
+
+    return None
+
+
+# mp4
+
+
+def _mp4_boxes(f, start, end):
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack(">I4s", f.read(8))
+        header = 8
+
+        if size == 1:
+            (size,) = struct.unpack(">Q", f.read(8))
+            header = 16
+        elif size == 0:
+            size = end - pos
+
+        if size < header:
+            raise ProbeError("bad mp4 box size")
+
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _mp4_find(f, start, end, *path):
+    for kind, body, box_end in _mp4_boxes(f, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return body, box_end
+            return _mp4_find(f, body, box_end, *path[1:])
+
+    return None
+
+
+def _read_mp4(f):
+    f.seek(0, os.SEEK_END)
+    moov = _mp4_find(f, 0, f.tell(), b"moov")
+    if not moov:
+        raise ProbeError("no moov box")
+
+    mvhd = _mp4_find(f, *moov, b"mvhd")
+    if not mvhd:
+        raise ProbeError("no mvhd box")
+
+    f.seek(mvhd[0])
+    version = f.read(4)[0]
+    if version == 1:
+        _, _, timescale, length = struct.unpack(">QQIQ", f.read(28))
+    else:
+        _, _, timescale, length = struct.unpack(">IIII", f.read(16))
+
+    codec = None
+    sample_rate = None
+    stsd = _mp4_find(f, *moov, b"trak", b"mdia", b"minf", b"stbl", b"stsd")
+    if stsd:
+        # version/flags, entry count, then the first sample entry
+        f.seek(stsd[0] + 8)
+        _, fourcc = struct.unpack(">I4s", f.read(8))
+        fourcc = fourcc.decode("latin-1")
+        codec = MP4_CODECS.get(fourcc, fourcc)
+
+        # reserved, data reference index, version, revision, vendor, channels, sample size,
+        # compression id, packet size, then the rate as 16.16 fixed point
+        f.seek(stsd[0] + 16 + 24)
+        sample_rate = struct.unpack(">I", f.read(4))[0] >> 16
+
+    return _result(length / timescale if timescale else None, codec, sample_rate)
+
+
+# matroska / webm
+
+MKV_SEGMENT = 0x18538067
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_AUDIO = 0xE1
+MKV_SAMPLING_FREQUENCY = 0xB5
+MKV_CLUSTER = 0x1F43B675
+
+
+def _ebml_vint(f, keep_marker=False):
+    byte = f.read(1)
+    if not byte:
+        raise EOFError
+
+    first = byte[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+
+    if length > 8:
+        raise ProbeError("bad ebml vint")
+
+    value = first if keep_marker else first & (mask - 1)
+    for byte in f.read(length - 1):
+        value = value << 8 | byte
+
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, unknown
+
+
+def _ebml_elements(f, start, end):
+    f.seek(start)
+    while end is None or f.tell() < end:
+        try:
+            element, _ = _ebml_vint(f, keep_marker=True)
+        except EOFError:
+            return
+        size, unknown = _ebml_vint(f)
+        body = f.tell()
+
+        yield element, body, None if unknown else body + size
+
+        if unknown:
+            # Only the segment and clusters ever have an unknown size, and we don't read past either
+            return
+        f.seek(body + size)
+
+
+def _ebml_read(f, start, end):
+    f.seek(start)
+    return f.read(end - start)
+
+
+def _ebml_uint(data):
+    return int.from_bytes(data, "big")
+
+
+def _ebml_float(data):
+    if len(data) == 4:
+        return struct.unpack(">f", data)[0]
+    if len(data) == 8:
+        return struct.unpack(">d", data)[0]
+    return None
+
+
+def _read_matroska(f):
+    for element, body, end in _ebml_elements(f, 0, None):
+        if element == MKV_SEGMENT:
+            segment = (body, end)
+            break
+    else:
+        raise ProbeError("no segment")
+
+    scale = 1000000
+    duration = None
+    codec = None
+    sample_rate = None
+
+    for element, body, end in _ebml_elements(f, *segment):
+        if element == MKV_INFO:
+            for child, child_body, child_end in _ebml_elements(f, body, end):
+                if child == MKV_TIMECODE_SCALE:
+                    scale = _ebml_uint(_ebml_read(f, child_body, child_end))
+                elif child == MKV_DURATION:
+                    duration = _ebml_float(_ebml_read(f, child_body, child_end))
+
+        elif element == MKV_TRACKS:
+            for track, track_body, track_end in _ebml_elements(f, body, end):
+                if track != MKV_TRACK_ENTRY or codec:
+                    continue
+
+                fields = {}
+                for child, child_body, child_end in _ebml_elements(
+                    f, track_body, track_end
+                ):
+                    fields[child] = (child_body, child_end)
+
+                if MKV_TRACK_TYPE not in fields:
+                    continue
+                if _ebml_uint(_ebml_read(f, *fields[MKV_TRACK_TYPE])) != 2:
+                    continue
+
+                if MKV_CODEC_ID in fields:
+                    codec_id = _ebml_read(f, *fields[MKV_CODEC_ID])
+                    codec_id = codec_id.rstrip(b"\0").decode("ascii", "replace")
+                    codec = MATROSKA_CODECS.get(codec_id, codec_id)
+
+                if MKV_AUDIO in fields:
+                    for child, child_body, child_end in _ebml_elements(
+                        f, *fields[MKV_AUDIO]
+                    ):
+                        if child == MKV_SAMPLING_FREQUENCY:
+                            sample_rate = _ebml_float(
+                                _ebml_read(f, child_body, child_end)
+                            )
+                            sample_rate = int(sample_rate) if sample_rate else None
+
+        elif element == MKV_CLUSTER:
+            break
+
+        if duration is not None and codec:
+            break
+
+    if duration is not None:
+        duration = duration * scale / 1000000000
+
+    return _result(duration, codec, sample_rate)
+
+
+# ogg
+
+
+def _read_ogg(f):
+    header = f.read(27)
+    if header[:4] != b"OggS":
+        raise ProbeError("not an ogg page")
+
+    segments = f.read(header[26])
+    packet = f.read(sum(segments))
+
+    if packet.startswith(b"OpusHead"):
+        codec = "opus"
+        # Opus granule positions always count 48kHz samples, including the pre-skip
+        rate = 48000
+        (skip,) = struct.unpack("<H", packet[10:12])
+    elif packet.startswith(b"\x01vorbis"):
+        codec = "vorbis"
+        (rate,) = struct.unpack("<I", packet[12:16])
+        skip = 0
+    else:
+        raise ProbeError("unknown ogg codec")
+
+    # The granule position of the last page is the length of the stream, in samples
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(max(0, size - 65536))
+    tail = f.read()
+
+    index = len(tail)
+    while True:
+        index = tail.rfind(b"OggS", 0, index)
+        if index == -1:
+            raise ProbeError("no last ogg page")
+
+        (granule,) = struct.unpack("<q", tail[index + 6 : index + 14])
+        if granule != -1:
+            break
+
+    return _result(max(0, granule - skip) / rate, codec, rate)
+
+
+# fallbacks
+
+
+def read_mediainfo(filename):
+    mediainfo = pymediainfo.MediaInfo.parse(filename)
+    duration = mediainfo.tracks[0].duration
+    return _result(duration / 1000 if duration else None)
+
+
+async def ffprobe(filename):
+    """
+    Asks ffprobe for the duration and codec of `filename`, running a limited amount at a time.
+    """
+    global _ffprobe_slots
+    if _ffprobe_slots is None:
+        _ffprobe_slots = asyncio.Semaphore(FFPROBE_LIMIT)
+
+    executable = shutil.which("ffprobe")
+    if not executable:
+        raise ProbeError("ffprobe not found")
+
+    args = [
+        executable,
+        "-v",
+        "quiet",
+        "-of",
+        "json",
+        "-show_entries",
+        "format=duration:stream=codec_name,sample_rate",
+        "-select_streams",
+        "a:0",
+        "-i",
+        filename,
+    ]
+
+    async with _ffprobe_slots:
+        log.debug("Running ffprobe on {}".format(filename))
+        p = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await p.communicate()
+
+    data = json.loads(stdout.decode("utf-8"))
+    stream = (data.get("streams") or [{}])[0]
+
+    try:
+        duration = float(data.get("format", {})["duration"])
+    except (KeyError, TypeError, ValueError):
+        duration = None
+
+    try:
+        sample_rate = int(stream["sample_rate"])
+    except (KeyError, TypeError, ValueError):
+        sample_rate = None
+
+    return _result(duration, stream.get("codec_name"), sample_rate)
+
+
+async def probe(filename, loop=None):
+    """
+    Returns a dict with the "duration", "codec" and "sample_rate" of `filename`, any of which
+    may be None if it couldn't be found out.
+    """
+    loop = loop or asyncio.get_event_loop()
+
+    result = await loop.run_in_executor(None, read_header, filename)
+    if result and result["duration"]:
+        return result
+
+    if pymediainfo:
+        try:
+            result = await loop.run_in_executor(None, read_mediainfo, filename)
+            if result["duration"]:
+                return result
+        except Exception:
+            log.debug("pymediainfo could not read {}".format(filename), exc_info=True)
+
+    try:
+        return await ffprobe(filename)
+    except Exception:
+        log.debug("ffprobe could not read {}".format(filename), exc_info=True)
+
+    return result or _result()
@@ -0,0 +1,218 @@
+import os
+import re
+import sys
+import time
+import asyncio
+import logging
+import selectors
+import threading
+
+from .exceptions import FFmpegError
+
+log = logging.getLogger(__name__)
+
+# Messages ffmpeg prints that don't mean anything is wrong
+FFMPEG_WARNINGS = re.compile(
+    "|".join(
+        re.escape(message)
+        for message in [
+            "Header missing",
+            "Estimating duration from birate, this may be inaccurate",
+            "Using AVStream.codec to pass codec parameters to muxers is deprecated, use AVStream.codecpar instead.",
+            "Application provided invalid, non monotonically increasing dts to muxer in stream",
+            "Last message repeated",
+            "Failed to send close message",
+            "decode_band_types: Input buffer exhausted before END element found",
+        ]
+    )
+)
+
+# Messages that mean the song can't be played (properly)
+FFMPEG_ERRORS = re.compile(
+    "|".join(
+        re.escape(message)
+        for message in [
+            "Invalid data found when processing input",  # need to regex this properly, its both a warning and an error
+        ]
+    )
+)
+
+LINE_END = re.compile(rb"[\r\n]")
+
+
+class FFmpegProcess:
+    """
+    The health of an ffmpeg process started through the `FFmpegSupervisor`.
+    `exited` resolves once it has exited, with True or the last error it printed, and
+    `returncode` is set by then.
+    """
+
+    def __init__(self, process, loop):
+        self.pid = process.pid
+        self.process = process
+        self.started = time.time()
+        self.warnings = 0
+        self.errors = []
+        self.returncode = None
+        self.exited = loop.create_future()
+
+        self._loop = loop
+        self._buffer = b""
+
+    @property
+    def alive(self):
+        return not self.exited.done()
+
+    @property
+    def error(self):
+        """
+        The last error ffmpeg printed, if any.
+        """
+        return self.errors[-1] if self.errors else None
+
+    def _feed(self, data):
+        lines = LINE_END.split(self._buffer + data)
+        self._buffer = lines.pop()
+        for line in lines:
+            if line:
+                self._classify(line)
+
+    def _classify(self, line):
+        try:
+            line = line.decode("utf8")
+        except UnicodeDecodeError:
+            log.ffmpeg("Unknown error decoding message from ffmpeg", exc_info=True)
+            line = line.decode("utf8", "replace")
+
+        log.ffmpeg("Data from ffmpeg: {}".format(line))
+
+        if FFMPEG_WARNINGS.search(line):
+            self.warnings += 1  # useless message
+
+        elif FFMPEG_ERRORS.search(line):
+            log.ffmpeg("Error from ffmpeg: %s", line.strip())
+            self.errors.append(FFmpegError(line))
+
+        else:
+            sys.stderr.write(line + "\n")
+            sys.stderr.flush()
+
+    def _eof(self):
+        if self._buffer:
+            self._classify(self._buffer)
+            self._buffer = b""
+
+        self._loop.call_soon_threadsafe(self._reap)
+
+    def _reap(self):
+        # ffmpeg can close stderr a little before it has actually exited
+        waiting = self._loop.run_in_executor(None, self.process.wait)
+        waiting.add_done_callback(self._exit)
+
+    def _exit(self, waiting):
+        if not waiting.cancelled() and not waiting.exception():
+            self.returncode = waiting.result()
+
+        if self.exited.done():
+            return
+
+        if self.error:
+            self.exited.set_exception(self.error)
+            # Nobody might be waiting for it
+            self.exited.exception()
+        else:
+            self.exited.set_result(True)
+
+
+class FFmpegSupervisor:
+    """
+    Watches what every ffmpeg process the bot starts prints, from a single thread instead of
+    one per process. Windows can't wait on pipes like that, so it still gets a thread per process.
+
+    The processes that are still running can be found in `processes`, by pid.
+    """
+
+    def __init__(self):
+        self.processes = {}
+
+        self._lock = threading.Lock()
+        self._selector = None
+        self._pending = []
+        self._wakeup = None
+
+    def spawn(self, factory):
+        """
+        Calls `factory` with the file ffmpeg should print to, which it should pass on as the
+        stderr of the ffmpeg audio source it creates. Returns the source and its `FFmpegProcess`.
+        """
+        read_fd, write_fd = os.pipe()
+        try:
+            with os.fdopen(write_fd, "wb") as stderr:
+                source = factory(stderr)
+        except BaseException:
+            os.close(read_fd)
+            raise
+
+        process = FFmpegProcess(source._process, asyncio.get_event_loop())
+        self.processes[process.pid] = process
+        process.exited.add_done_callback(lambda _: self.processes.pop(process.pid, None))
+
+        if sys.platform == "win32":
+            threading.Thread(
+                target=self._read_blocking,
+                args=(read_fd, process),
+                name="ffmpeg stderr reader",
+                daemon=True,
+            ).start()
+        else:
+            self._register(read_fd, process)
+
+        return source, process
+
+    @staticmethod
+    def _read_blocking(fd, process):
+        with os.fdopen(fd, "rb") as f:
+            for data in iter(lambda: f.read1(4096), b""):
+                process._feed(data)
+        process._eof()
+
+    def _register(self, fd, process):
+        with self._lock:
+            if self._selector is None:
+                self._selector = selectors.DefaultSelector()
+                self._wakeup = os.pipe()
+                self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+                threading.Thread(
+                    target=self._run, name="ffmpeg supervisor", daemon=True
+                ).start()
+
+            self._pending.append((fd, process))
+
+        os.write(self._wakeup[1], b"\0")
+
+    def _run(self):
+        while True:
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    os.read(key.fd, 4096)
+                    with self._lock:
+                        pending, self._pending = self._pending, []
+                    for fd, process in pending:
+                        self._selector.register(fd, selectors.EVENT_READ, process)
+                    continue
+
+                process = key.data
+                try:
+                    data = os.read(key.fd, 4096)
+                except OSError:
+                    data = b""
+
+                if data:
+                    try:
+                        process._feed(data)
+                    except Exception:
+                        log.error("Error reading ffmpeg's output", exc_info=True)
+                else:
+                    self._selector.unregister(key.fd)
+                    os.close(key.fd)
+                    process._eof()
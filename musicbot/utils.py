@@ -1,4 +1,5 @@
 import sys
+import math
 import logging
 import aiohttp
 import inspect
@@ -88,6 +89,20 @@ def ftimedelta(td):
     return ":".join([p1, "{:02d}".format(int(float(p2)))])
 
 
+def parse_duration(text):
+    """
+    Parses a duration given as seconds or as [[hours:]minutes:]seconds into seconds.
+    """
+    seconds = 0
+    for part in text.split(":"):
+        seconds = seconds * 60 + float(part)
+
+    # float() also takes "inf" and "nan"
+    if not math.isfinite(seconds):
+        raise ValueError("{!r} is not a duration".format(text))
+    return seconds
+
+
 def safe_print(content, *, end="\n", flush=True):
     sys.stdout.buffer.write((content + end).encode("utf-8", "replace"))
     if flush:
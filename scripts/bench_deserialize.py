@@ -0,0 +1,88 @@
+"""
+Measures how long loading a saved queue takes, with a DeserializationContext compared to the
+old way of finding the bot, playlist and voice client by walking the stack for every entry.
+"""
+
+import time
+import json
+import pydoc
+import asyncio
+import argparse
+
+from benchutil import fake_bot
+
+from musicbot.utils import _get_variable
+from musicbot.entry import URLPlaylistEntry
+from musicbot.playlist import Playlist
+from musicbot.constructs import DeserializationContext, Serializable
+
+
+class StackWalkingContext:
+    """
+    Finds the bot, playlist and voice client the way Serializer.deserialize used to: by looking
+    through the locals of every frame on the stack, each time one is needed.
+    """
+
+    bot = property(lambda self: _get_variable("bot"))
+    voice_client = property(lambda self: _get_variable("voice_client"))
+    playlist = property(lambda self: _get_variable("playlist"))
+
+
+def stack_walking_hook(data):
+    """
+    What Serializer.deserialize used to do, finding classes by name instead of in a registry.
+    """
+    if all(x in data for x in Serializable._class_signature):
+        factory = pydoc.locate(data["__module__"] + "." + data["__class__"])
+        if factory and issubclass(factory, Serializable):
+            return factory._deserialize(data["data"], StackWalkingContext())
+
+    return data
+
+
+def load(raw_json, object_hook, depth):
+    """
+    Loads `raw_json` from `depth` frames down, since the bot deserializes queues from well
+    inside its event handlers.
+    """
+    if depth:
+        return load(raw_json, object_hook, depth - 1)
+
+    start = time.perf_counter()
+    loaded = json.loads(raw_json, object_hook=object_hook)
+    return loaded, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--depth", type=int, default=20)
+    args = parser.parse_args()
+
+    bot = fake_bot(asyncio.new_event_loop())
+    voice_client = None
+    playlist = Playlist(bot)
+    for i in range(args.entries):
+        playlist.entries.append(
+            URLPlaylistEntry(
+                playlist,
+                "https://www.youtube.com/watch?v=%011d" % i,
+                "Song %d" % i,
+                200,
+                "audio_cache/youtube-%011d.webm" % i,
+            )
+        )
+    raw_json = playlist.serialize()
+
+    context = DeserializationContext(bot, voice_client, playlist)
+    for name, object_hook in [
+        ("context", context.object_hook),
+        ("stack walking", stack_walking_hook),
+    ]:
+        loaded, took = load(raw_json, object_hook, args.depth)
+        assert len(loaded.entries) == args.entries
+        print("{:14} {:8.0f}ms for {} entries".format(name, took * 1000, args.entries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Compares the thread and process extraction backends (ExtractionBackend in options.ini).
+
+Runs a batch of extractions at once through a worker lane of each kind, using a stand-in for
+ytdl.extract_info that spends its time on json and regexes like a real extractor does. While
+they run, a timer ticks on the event loop every 20ms like the voice send loop does, and how
+late it fires shows how much the extractions would make the audio stutter.
+"""
+
+import re
+import json
+import time
+import asyncio
+import argparse
+import functools
+
+import benchutil  # noqa: F401
+
+from musicbot.downloader import WorkerLane, ytdl_format_options
+
+TICK = 0.02
+
+
+def fake_extract(index, formats):
+    """
+    Stands in for ytdl.extract_info: parses a big json "page" and deciphers its urls.
+    """
+    page = json.dumps(
+        {
+            "videoDetails": {"videoId": "%011d" % index, "title": "Song %d" % index},
+            "formats": [
+                {
+                    "itag": i,
+                    "url": "https://example.com/%d/%d?sig=%s" % (index, i, "ab" * 100),
+                }
+                for i in range(formats)
+            ],
+        }
+    )
+    data = json.loads(page)
+
+    return {
+        "id": data["videoDetails"]["videoId"],
+        "title": data["videoDetails"]["title"],
+        "formats": [
+            {
+                "format_id": str(fmt["itag"]),
+                "url": re.sub(
+                    r"sig=(\w+)", lambda m: "sig=" + m.group(1)[::-1], fmt["url"]
+                ),
+            }
+            for fmt in data["formats"]
+        ],
+    }
+
+
+async def measure_loop(stop):
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+    return lags
+
+
+async def bench(backend, jobs, workers, formats):
+    loop = asyncio.get_running_loop()
+    lane = WorkerLane(
+        "bench",
+        workers,
+        process_options=dict(ytdl_format_options) if backend == "process" else None,
+    )
+
+    def job(index):
+        return lane.run(loop, functools.partial(fake_extract, index, formats))
+
+    # Start the worker processes before timing anything
+    await asyncio.gather(*(job(i) for i in range(workers)))
+
+    stop = asyncio.Event()
+    ticker = loop.create_task(measure_loop(stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(job(i) for i in range(jobs)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    lags = await ticker
+    lane.shutdown()
+
+    late = sum(lag > TICK for lag in lags)
+    print(
+        "{:8} {:6.2f}s total, loop late by {:5.1f}ms on average, {:6.1f}ms at worst, "
+        "{} of {} ticks over {:.0f}ms late".format(
+            backend,
+            elapsed,
+            sum(lags) / len(lags) * 1000,
+            max(lags) * 1000,
+            late,
+            len(lags),
+            TICK * 1000,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--formats", type=int, default=3000)
+    args = parser.parse_args()
+
+    for backend in ("thread", "process"):
+        asyncio.run(bench(backend, args.jobs, args.workers, args.formats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Measures the gap between the last frame of one song and the first frame of the next, with
+GaplessPlayback off and on.
+
+A few generated songs are queued on a real MusicPlayer, which plays them through a stand-in for
+discord's voice client that reads a frame every 20ms on its own thread, like discord's audio
+player does. Without GaplessPlayback the next song is started the moment the player asks for it,
+so that gap is the best the bot can do that way.
+"""
+
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from benchutil import fake_bot
+
+from musicbot.entry import URLPlaylistEntry
+from musicbot.player import MusicPlayer
+from musicbot.playlist import Playlist
+from musicbot.supervisor import FFmpegSupervisor
+
+
+class PacedVoiceClient:
+    """
+    Plays sources like discord's voice client, remembering when every frame was read.
+    """
+
+    # Discord creates its encoder when playback starts with pcm, it's never used here
+    encoder = "pcm"
+
+    def __init__(self):
+        self.frames = []
+        self._stopped = None
+
+    def play(self, source, *, after=None):
+        self._stopped = threading.Event()
+        threading.Thread(
+            target=self._run, args=(source, after, self._stopped), daemon=True
+        ).start()
+
+    def stop(self):
+        if self._stopped:
+            self._stopped.set()
+
+    def _run(self, source, after, stopped):
+        start = time.perf_counter()
+        loops = 0
+
+        try:
+            while not stopped.is_set():
+                if not source.read():
+                    break
+
+                self.frames.append(time.perf_counter())
+                loops += 1
+                time.sleep(max(0, start + loops * 0.02 - time.perf_counter()))
+        finally:
+            source.cleanup()
+            if after:
+                after(None)
+
+
+def generate_song(filename, seconds, frequency):
+    subprocess.run(
+        [
+            shutil.which("ffmpeg"),
+            "-nostdin",
+            "-v",
+            "quiet",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency={}:duration={}".format(frequency, seconds),
+            filename,
+        ],
+        check=True,
+    )
+
+
+async def play_songs(filenames, seconds, gapless):
+    """
+    Plays every song in `filenames` and returns when every frame was read.
+    """
+    loop = asyncio.get_running_loop()
+    bot = fake_bot(
+        loop,
+        save_videos=True,
+        default_volume=0.15,
+        opus_passthrough=False,
+        ffmpeg_volume=False,
+        gapless_playback=gapless,
+        progressive_playback=False,
+    )
+    bot.ffmpeg_supervisor = FFmpegSupervisor()
+
+    playlist = Playlist(bot)
+    # The songs are already on the disk
+    playlist.predownload = lambda: None
+
+    entries = []
+    for filename in filenames:
+        entry = URLPlaylistEntry(playlist, filename, filename, seconds, filename)
+        entry.filename = filename
+        entry.aoptions = "-vn -v quiet"
+        entries.append(entry)
+
+    voice_client = PacedVoiceClient()
+    player = MusicPlayer(bot, voice_client, playlist)
+    done = loop.create_future()
+
+    def on_finished(player, entry, gapless=False, **_):
+        if entry is entries[-1]:
+            loop.call_soon_threadsafe(done.set_result, None)
+        # What the bot does when a song finishes, as soon as it can
+        elif not gapless:
+            loop.call_soon_threadsafe(player.play, True)
+
+    player.on("finished-playing", on_finished)
+    playlist.add_entries(entries)
+    player.play()
+
+    await done
+    player.kill()
+    return voice_client.frames
+
+
+def gaps(frames, songs, seconds):
+    """
+    The time between the frames on either side of every change of song, less the 20ms
+    between frames that's always there.
+    """
+    per_song = seconds * 50
+    if len(frames) != songs * per_song:
+        raise RuntimeError(
+            "Read {} frames of {} songs of {}s".format(len(frames), songs, seconds)
+        )
+
+    return [
+        frames[song * per_song] - frames[song * per_song - 1] - 0.02
+        for song in range(1, songs)
+    ]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--songs", type=int, default=4)
+    parser.add_argument("--seconds", type=int, default=8)
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        print("ffmpeg isn't installed")
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        filenames = []
+        for i in range(args.songs):
+            filenames.append("{}/song-{}.mp3".format(folder, i))
+            generate_song(filenames[-1], args.seconds, 220 * (i + 1))
+
+        for gapless in (False, True):
+            frames = await play_songs(filenames, args.seconds, gapless)
+            found = gaps(frames, args.songs, args.seconds)
+            print(
+                "GaplessPlayback = {:3}  {:6.1f}ms average gap, {:6.1f}ms at most".format(
+                    "yes" if gapless else "no",
+                    sum(found) / len(found) * 1000,
+                    max(found) * 1000,
+                )
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
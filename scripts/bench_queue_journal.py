@@ -0,0 +1,94 @@
+"""
+Measures how much is written to disk for each change to a long queue, when the whole queue is
+saved every time compared to when changes are appended to a queue journal.
+"""
+
+import json
+import time
+import asyncio
+import argparse
+
+from benchutil import fake_bot
+
+from musicbot.entry import URLPlaylistEntry
+from musicbot.playlist import Playlist
+from musicbot.constructs import Serializer
+from musicbot.persistence import QueueJournal
+
+
+class CountingPersistence:
+    """
+    Stands in for QueuePersistence, saving right away and only counting what would be written.
+    """
+
+    def __init__(self):
+        self.written = 0
+
+    def mark_dirty(self, key, filename, serialize, write):
+        append, text = serialize()
+        self.written += len(text)
+
+
+def make_entry(playlist, i):
+    return URLPlaylistEntry(
+        playlist,
+        "https://www.youtube.com/watch?v=%011d" % i,
+        "Some song title %d" % i,
+        200,
+        "audio_cache/youtube-%011d.webm" % i,
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--changes", type=int, default=100)
+    args = parser.parse_args()
+
+    playlist = Playlist(fake_bot(asyncio.get_running_loop()))
+    # Nothing is downloaded here
+    playlist.predownload = lambda: None
+    playlist.add_entries(make_entry(playlist, i) for i in range(args.entries))
+
+    persistence = CountingPersistence()
+    playlist.journal = QueueJournal(
+        persistence,
+        0,
+        "queue.journal",
+        lambda: {"entries": list(playlist.entries), "current": None, "progress": None},
+    )
+    playlist.journal.record("current", entry=None, progress=None)
+    first_snapshot = persistence.written
+
+    snapshot_bytes = snapshot_time = journal_time = 0
+    for i in range(args.changes):
+        start = time.perf_counter()
+        if i % 2:
+            playlist.delete_entry_at_index(len(playlist) // 2)
+        else:
+            playlist.add_entries([make_entry(playlist, args.entries + i)])
+        journal_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        snapshot_bytes += len(
+            json.dumps({"entries": list(playlist.entries)}, cls=Serializer)
+        )
+        snapshot_time += time.perf_counter() - start
+
+    journal_bytes = persistence.written - first_snapshot
+    print(
+        "whole queue per change: {:10.0f} bytes, {:7.2f}ms".format(
+            snapshot_bytes / args.changes, snapshot_time / args.changes * 1000
+        )
+    )
+    print(
+        "journal per change:     {:10.0f} bytes, {:7.2f}ms (after a {} byte snapshot)".format(
+            journal_bytes / args.changes,
+            journal_time / args.changes * 1000,
+            first_snapshot,
+        )
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,174 @@
+"""
+Measures how often a live stream drops out when its connection stalls, played straight from ffmpeg
+compared to through the StreamBuffer live streams are played with.
+
+A local http server plays a generated song like a radio station, at the pace it's listened to,
+and stalls for a while every so often. The stream is read the way discord's audio player reads
+it, one 20ms frame at a time, and every time playback falls behind or has to fill in with
+silence counts as a dropout.
+"""
+
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+import http.server
+
+import benchutil  # noqa: F401
+
+from discord import FFmpegPCMAudio
+
+from musicbot.player import PCM_SILENCE, RECONNECT_OPTIONS, StreamBuffer
+
+# The bitrate the song is served at, in bytes per second
+BYTES_PER_SECOND = 16000
+
+
+class StallingStream(http.server.BaseHTTPRequestHandler):
+    """
+    Streams `song` in real time, stalling for `stall` seconds every `stall_every` seconds of it.
+    """
+
+    song = b""
+    stall = 0
+    stall_every = 0
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.end_headers()
+
+        chunk = BYTES_PER_SECOND // 10
+        start = time.perf_counter()
+        next_stall = self.stall_every
+
+        try:
+            for position in range(0, len(self.song), chunk):
+                self.wfile.write(self.song[position : position + chunk])
+                self.wfile.flush()
+
+                sent = position / BYTES_PER_SECOND
+                if self.stall_every and sent >= next_stall:
+                    next_stall += self.stall_every
+                    time.sleep(self.stall)
+
+                # Keep a second ahead of the listener like a radio station would, catching up
+                # on what was held back by a stall right after it
+                time.sleep(max(0, start + sent - 1 - time.perf_counter()))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def generate_song(folder, seconds):
+    filename = folder + "/song.mp3"
+    subprocess.run(
+        [
+            shutil.which("ffmpeg"),
+            "-nostdin",
+            "-v",
+            "quiet",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=440:duration={}".format(seconds),
+            "-b:a",
+            "{}k".format(BYTES_PER_SECOND * 8 // 1000),
+            filename,
+        ],
+        check=True,
+    )
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def open_stream(url):
+    return FFmpegPCMAudio(
+        url,
+        before_options="-nostdin" + RECONNECT_OPTIONS,
+        options="-vn -v quiet",
+    )
+
+
+def listen(source, seconds):
+    """
+    Reads `seconds` of audio from `source` at the pace discord's audio player does. Returns how
+    many times playback dropped out, and how many seconds of audio were missing in total.
+    """
+    dropouts = 0
+    missing = 0
+    # How long the dropout going on now has lasted so far
+    gap = 0
+    start = time.perf_counter()
+
+    for frame in range(int(seconds / 0.02)):
+        data = source.read()
+        if not data:
+            break
+
+        # Discord catches up on late frames instead of skipping them, so a late frame is a gap
+        # as long as it was late
+        late = time.perf_counter() - (start + frame * 0.02)
+        if data is PCM_SILENCE or late > 0.02:
+            dropouts += not gap
+            gap = gap + 0.02 if data is PCM_SILENCE else max(gap, late)
+        else:
+            missing += gap
+            gap = 0
+
+        time.sleep(max(0, start + (frame + 1) * 0.02 - time.perf_counter()))
+
+    missing += gap
+    return dropouts, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--stall", type=float, default=1.5)
+    parser.add_argument("--stall-every", type=float, default=5)
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        print("ffmpeg isn't installed")
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        StallingStream.song = generate_song(folder, args.seconds + 10)
+    StallingStream.stall = args.stall
+    StallingStream.stall_every = args.stall_every
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StallingStream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/stream".format(server.server_port)
+
+    print(
+        "Stalling for {}s every {}s of a {}s stream".format(
+            args.stall, args.stall_every, args.seconds
+        )
+    )
+
+    source = open_stream(url)
+    dropouts, missing = listen(source, args.seconds)
+    source.cleanup()
+    print("{:14} {:3} dropouts, {:5.2f}s missing".format("ffmpeg", dropouts, missing))
+
+    source = StreamBuffer(open_stream(url), lambda: open_stream(url))
+    source.wait_ready(10)
+    dropouts, missing = listen(source, args.seconds)
+    source.cleanup()
+    print(
+        "{:14} {:3} dropouts, {:5.2f}s missing".format(
+            "StreamBuffer", dropouts, missing
+        )
+    )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
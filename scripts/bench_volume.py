@@ -0,0 +1,135 @@
+"""
+Measures what changing the volume costs per 20ms frame of audio, for each way of doing it.
+
+discord's PCMVolumeTransformer (and audioop or numpy when they're installed) change the volume
+of every frame in the audio thread, in python. With FFmpegVolume the volume filter runs inside
+ffmpeg instead, which is measured as the extra cpu time ffmpeg spends decoding with it.
+"""
+
+import math
+import time
+import array
+import shutil
+import argparse
+import resource
+import subprocess
+
+import benchutil  # noqa: F401
+
+from discord import AudioSource, PCMVolumeTransformer
+
+from musicbot.player import PCM_BYTES_PER_SECOND, with_volume
+
+FRAME_SIZE = PCM_BYTES_PER_SECOND // 50
+
+
+def sine_frame():
+    samples = array.array(
+        "h",
+        (
+            int(12000 * math.sin(i / 48000 * 2 * math.pi * 440))
+            for i in range(FRAME_SIZE // 2)
+        ),
+    )
+    return samples.tobytes()
+
+
+class FrameSource(AudioSource):
+    def __init__(self, frame):
+        self.frame = frame
+
+    def read(self):
+        return self.frame
+
+
+def per_frame(transform, frames):
+    start = time.perf_counter()
+    for _ in range(frames):
+        transform()
+    return (time.perf_counter() - start) / frames
+
+
+def python_transforms(frame):
+    transformer = PCMVolumeTransformer(FrameSource(frame), 0.5)
+    yield "PCMVolumeTransformer", transformer.read
+
+    try:
+        import audioop
+    except ImportError:
+        print("audioop isn't available, skipping it")
+    else:
+        yield "audioop.mul", lambda: audioop.mul(frame, 2, 0.5)
+
+    try:
+        import numpy
+    except ImportError:
+        print("numpy isn't installed, skipping it")
+    else:
+
+        def numpy_volume():
+            samples = numpy.frombuffer(frame, dtype=numpy.int16) * 0.5
+            return numpy.clip(samples, -32768, 32767).astype(numpy.int16).tobytes()
+
+        yield "numpy", numpy_volume
+
+
+def ffmpeg_cpu(aoptions, seconds):
+    """
+    The cpu time ffmpeg takes to decode `seconds` of a generated song to pcm with `aoptions`.
+    """
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    subprocess.run(
+        [
+            shutil.which("ffmpeg"),
+            "-nostdin",
+            "-v",
+            "quiet",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=440:sample_rate=48000:duration={}".format(seconds),
+            *aoptions.split(),
+            "-f",
+            "s16le",
+            "-ar",
+            "48000",
+            "-ac",
+            "2",
+            "-",
+        ],
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--seconds", type=int, default=600)
+    args = parser.parse_args()
+
+    frame = sine_frame()
+    for name, transform in python_transforms(frame):
+        cost = per_frame(transform, args.frames)
+        print(
+            "{:22} {:9.1f}us per frame in the audio thread".format(name, cost * 1000000)
+        )
+
+    if not shutil.which("ffmpeg"):
+        print("ffmpeg isn't installed, skipping it")
+        return
+
+    frames = args.seconds * 50
+    plain = ffmpeg_cpu("-vn", args.seconds)
+    with_filter = ffmpeg_cpu(with_volume("-vn", 0.5), args.seconds)
+    print(
+        "{:22} {:9.1f}us per frame in ffmpeg, 0us in the audio thread".format(
+            "ffmpeg volume filter", (with_filter - plain) / frames * 1000000
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Shared setup for the benchmark scripts in this folder. Importing it makes the musicbot package
+importable, the scripts are meant to be run from anywhere with `python scripts/<name>.py`.
+"""
+
+import os
+import sys
+import types
+import pathlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# musicbot starts logging to logs/musicbot.log as soon as it's imported
+pathlib.Path("logs").mkdir(exist_ok=True)
+
+
+def fake_bot(loop, **config):
+    """
+    A stand-in for the bot, with just enough of it for playlists and entries to work.
+    """
+    config.setdefault("save_videos", False)
+
+    return types.SimpleNamespace(
+        loop=loop,
+        config=types.SimpleNamespace(**config),
+        downloader=types.SimpleNamespace(download_folder="audio_cache"),
+    )
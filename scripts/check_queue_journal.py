@@ -0,0 +1,83 @@
+"""
+Checks that a journaled queue survives the bot restarting: the queue is journaled, the player is
+torn down the way the bot does it when it shuts down, and the journal is replayed into a new
+player, which has to end up with the same queue.
+"""
+
+import sys
+import asyncio
+import tempfile
+
+from benchutil import fake_bot
+
+from musicbot.entry import URLPlaylistEntry
+from musicbot.player import MusicPlayer
+from musicbot.playlist import Playlist
+from musicbot.persistence import QueueJournal, QueuePersistence
+
+
+def make_entry(playlist, i):
+    return URLPlaylistEntry(
+        playlist,
+        "https://www.youtube.com/watch?v=%011d" % i,
+        "Song %d" % i,
+        200,
+        "audio_cache/youtube-%011d.webm" % i,
+    )
+
+
+def new_player(bot):
+    playlist = Playlist(bot)
+    # Nothing is downloaded here
+    playlist.predownload = lambda: None
+    return MusicPlayer(bot, None, playlist), playlist
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    bot = fake_bot(loop, default_volume=0.15, gapless_playback=False)
+    persistence = QueuePersistence(loop)
+
+    with tempfile.TemporaryDirectory() as folder:
+        filename = folder + "/queue.journal"
+
+        player, playlist = new_player(bot)
+        playlist.journal = QueueJournal(
+            persistence,
+            0,
+            filename,
+            lambda: {
+                "entries": list(playlist.entries),
+                "current": player.current_entry,
+                "progress": player.progress,
+            },
+        )
+
+        playlist.add_entries(make_entry(playlist, i) for i in range(10))
+        persistence.flush()
+        playlist.delete_entry_at_index(3)
+        playlist.add_entries([make_entry(playlist, 10)])
+        expected = [entry.url for entry in playlist.entries]
+
+        # What the bot does when it shuts down
+        persistence.flush()
+        player.kill()
+        persistence.close()
+
+        with open(filename, encoding="utf8") as f:
+            journal = f.read()
+
+    restored, playlist = new_player(bot)
+    restored = MusicPlayer.from_journal(journal, bot, None, playlist)
+    found = [entry.url for entry in restored.playlist.entries]
+
+    if found != expected:
+        print("Queue was not restored: expected {}, found {}".format(expected, found))
+        return 1
+
+    print("Queue of {} entries restored after a restart".format(len(found)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))